@@ -6,7 +6,11 @@ from src.app import compose_app
 
 try:
     app = compose_app()
-    uvicorn.run(app, host="0.0.0.0", port=8000)
 except Exception as e:
     print(f"Failed to compose app: {e}", file=sys.stderr)
     sys.exit(1)
+
+# Guarded so that spawned worker processes, which re-import this module, do not
+# start a server of their own
+if __name__ == "__main__":
+    uvicorn.run(app, host="0.0.0.0", port=8000)
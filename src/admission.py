@@ -0,0 +1,145 @@
+"""
+ADMISSION CONTROL
+
+Bounds how much work of each kind the server accepts. A request that would
+exceed the limit of its pool is rejected straight away with a `Retry-After`
+hint instead of waiting in an unbounded queue, so latency stays predictable under
+overload and one kind of traffic cannot starve the other.
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import Executor
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Any, Callable, Dict, Optional
+
+from fastapi import status
+
+from src.exception import AdmissionRejectedError
+from src.metrics import Counter, Gauge
+
+_CONTROLLERS: Dict[str, "AdmissionController"] = {}
+
+ADMISSION_REJECTIONS = Counter(
+    "admission_rejections_total",
+    "Requests rejected by admission control.",
+    labelnames=("pool", "reason"),
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "admission_in_flight",
+    "Admitted requests that are running or waiting to run.",
+    labelnames=("pool",),
+    callback=lambda: {(name,): c.in_flight for name, c in _CONTROLLERS.items()},
+)
+ADMISSION_QUEUED = Gauge(
+    "admission_queued",
+    "Admitted requests waiting for a free worker.",
+    labelnames=("pool",),
+    callback=lambda: {(name,): c.queued() for name, c in _CONTROLLERS.items()},
+)
+
+
+class AdmissionController:
+    """
+    Admits at most `max_concurrency + max_queue` requests of one pool at a time.
+
+    Attributes:
+        name (str): Pool name, used in errors and metrics.
+        max_concurrency (int): Requests allowed to run at once.
+        max_queue (int): Admitted requests allowed to wait for a running slot.
+        queue_timeout (Optional[float]): Seconds a queued request may wait before
+            it is dropped with a 503. None waits indefinitely.
+        retry_after (int): Seconds suggested to rejected clients.
+        in_flight (int): Requests currently admitted.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: int,
+        max_queue: int = 0,
+        queue_timeout: Optional[float] = None,
+        retry_after: int = 1,
+    ):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout or None
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        _CONTROLLERS[name] = self
+
+    def queued(self) -> int:
+        return max(self.in_flight - self.max_concurrency, 0)
+
+    @contextmanager
+    def admit(self):
+        """
+        Holds a slot for the duration of the `with` block.
+
+        Raises:
+            AdmissionRejectedError: With status 429 if the pool is full.
+        """
+        with self._lock:
+            if self.in_flight >= self.max_concurrency + self.max_queue:
+                self.reject("limit", status.HTTP_429_TOO_MANY_REQUESTS)
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    async def run(self, executor: Executor, fn: Callable, *args) -> Any:
+        """
+        Admits a call and runs it on `executor`, which should have
+        `max_concurrency` workers. Calls that waited in the executor queue for
+        longer than `queue_timeout` are dropped without running.
+
+        Raises:
+            AdmissionRejectedError: With status 429 if the pool is full, or 503
+                if the call timed out in the queue.
+        """
+        with self.admit():
+            admitted_at = perf_counter()
+
+            def call():
+                waited = perf_counter() - admitted_at
+                if self.queue_timeout is not None and waited > self.queue_timeout:
+                    self.reject("queue_timeout", status.HTTP_503_SERVICE_UNAVAILABLE)
+                return fn(*args)
+
+            return await asyncio.get_running_loop().run_in_executor(executor, call)
+
+    def reject(self, reason: str, status_code: int):
+        ADMISSION_REJECTIONS.inc(pool=self.name, reason=reason)
+        raise AdmissionRejectedError(self.name, reason, status_code, self.retry_after)
+
+
+def retrieval_admission_from_env() -> AdmissionController:
+    """
+    Creates the controller of search requests from the `RETRIEVAL_*` settings.
+    """
+    return AdmissionController(
+        "retrieval",
+        max_concurrency=int(
+            os.getenv("RETRIEVAL_CONCURRENCY") or min(32, (os.cpu_count() or 1) + 4)
+        ),
+        max_queue=int(os.getenv("RETRIEVAL_QUEUE_SIZE", 64)),
+        queue_timeout=float(os.getenv("RETRIEVAL_QUEUE_TIMEOUT", 2)),
+        retry_after=int(os.getenv("RETRIEVAL_RETRY_AFTER", 1)),
+    )
+
+
+def upload_admission_from_env() -> AdmissionController:
+    """
+    Creates the controller of concurrent uploads from the `INGEST_*` settings.
+    Uploads are not queued: beyond the limit they are rejected.
+    """
+    return AdmissionController(
+        "ingest_upload",
+        max_concurrency=int(os.getenv("INGEST_MAX_UPLOADS", 8)),
+        retry_after=int(os.getenv("INGEST_RETRY_AFTER", 5)),
+    )
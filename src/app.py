@@ -1,11 +1,88 @@
+import asyncio
 import os
+from contextlib import asynccontextmanager
 from pathlib import Path
+from time import perf_counter
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 
+from src.data_ingestion import shutdown_pdf_executor
+from src.exception import AdmissionRejectedError
+from src.jobs import get_job_queue, shutdown_job_queue
+from src.metrics import Gauge, render
 from src.middleware import ProcessTimeMiddleware
 from src.router import ingestion, retrieval
+from src.utils import (
+    clean_stale_workspaces,
+    close_vector_db,
+    get_logger,
+    get_vector_db,
+)
+
+STARTUP_SECONDS = Gauge(
+    "app_startup_seconds",
+    "Seconds spent in each startup phase of the application.",
+    labelnames=("phase",),
+)
+
+
+async def warmup(app: FastAPI):
+    """
+    Opens the shared vector database, which loads the embedding model, and warms
+    both up. `app.state.ready` is set once done.
+    """
+    logger = get_logger()
+    start = perf_counter()
+    try:
+        app.state.vector_db = await asyncio.to_thread(get_vector_db)
+        opened = perf_counter()
+        await asyncio.to_thread(app.state.vector_db.warmup)
+    except Exception as e:
+        logger.error({"application": "Startup", "error": e})
+        app.state.startup_error = str(e)
+        return
+    end = perf_counter()
+    app.state.startup_seconds = {
+        "open_vector_db": opened - start,
+        "warmup": end - opened,
+        "total": end - start,
+    }
+    for phase, seconds in app.state.startup_seconds.items():
+        STARTUP_SECONDS.set(seconds, phase=phase)
+    app.state.ready = True
+    logger.info(
+        {
+            "application": "Startup",
+            "action": "Application ready",
+            "startup_seconds": app.state.startup_seconds,
+        }
+    )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Starts the ingestion workers and warms up the vector database on startup, and
+    stops both on shutdown.
+
+    Warmup runs in the background so the server can answer liveness checks while
+    the model loads; `/ready` reports when it is done.
+    """
+    app.state.ready = False
+    app.state.startup_error = None
+    # workspaces of exited processes can never be picked up again; those of
+    # this process and of other workers sharing tmp/ may hold queued uploads
+    await asyncio.to_thread(clean_stale_workspaces)
+    app.state.job_queue = get_job_queue()
+    warming_up = asyncio.create_task(warmup(app))
+    yield
+    await warming_up
+    await asyncio.to_thread(shutdown_job_queue)
+    await asyncio.to_thread(shutdown_pdf_executor)
+    close_vector_db()
 
 
 def compose_app() -> FastAPI:
@@ -19,15 +96,11 @@ def compose_app() -> FastAPI:
     tmp_path = base_path / "tmp"
     model_cache = base_path / "local_model" / "e5-small-v2"
 
-    # creating temp_dir
-    if not os.path.exists(tmp_path):
-        os.mkdir(tmp_path)
-
-    # creating model cache dir
-    if not os.path.exists(model_cache):
-        os.mkdir(model_cache)
+    # creating temp_dir and model cache dir
+    os.makedirs(tmp_path, exist_ok=True)
+    os.makedirs(model_cache, exist_ok=True)
 
-    app = FastAPI()
+    app = FastAPI(lifespan=lifespan)
 
     app.add_middleware(
         CORSMiddleware,
@@ -39,6 +112,14 @@ def compose_app() -> FastAPI:
 
     app.add_middleware(ProcessTimeMiddleware)
 
+    @app.exception_handler(AdmissionRejectedError)
+    async def admission_rejected(request: Request, exc: AdmissionRejectedError):
+        return JSONResponse(
+            status_code=exc.status_code,
+            content={"message": str(exc)},
+            headers={"Retry-After": str(exc.retry_after)},
+        )
+
     app.include_router(ingestion)
     app.include_router(retrieval)
 
@@ -46,4 +127,40 @@ def compose_app() -> FastAPI:
     async def home():
         return {"message": "Welcome to data ingestion pipeline!"}
 
+    @app.get("/health")
+    async def health():
+        db = get_vector_db(create=False)
+        # counting chunks is a blocking store call, kept off the event loop
+        vector_db = (
+            await run_in_threadpool(db.health)
+            if db
+            else {"ready": False, "error": "not opened"}
+        )
+        return JSONResponse(
+            content={"vector_db": vector_db},
+            status_code=status.HTTP_200_OK
+            if vector_db["ready"]
+            else status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+
+    @app.get("/ready")
+    async def ready():
+        ready = getattr(app.state, "ready", False)
+        return JSONResponse(
+            content={
+                "ready": ready,
+                "startup_seconds": getattr(app.state, "startup_seconds", None),
+                "error": getattr(app.state, "startup_error", None),
+            },
+            status_code=status.HTTP_200_OK
+            if ready
+            else status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+
+    @app.get("/metrics")
+    async def metrics():
+        return PlainTextResponse(
+            render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+        )
+
     return app
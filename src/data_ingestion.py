@@ -8,17 +8,201 @@ This module provides functionality to process and embed text data from various s
 
 It includes functions for pre-processing data, creating document chunks, and embedding text.
 """  # noqa: E501
-import hashlib
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Optional, Union
+from itertools import batched, repeat
+from time import perf_counter
+from typing import Iterable, Iterator, List, Optional, Union
 
 import pandas as pd
 from langchain.schema import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyPDFLoader, TextLoader
 from pandas import DataFrame
+from pypdf import PdfReader
 
-from src.utils import VectorDB, get_logger
+from src.metrics import INGEST_CHUNKS, INGEST_STAGE_SECONDS
+from src.utils import VectorDB, content_hash, get_logger, get_vector_db
+
+
+def split_documents(documents: Iterable[Document]) -> List[Document]:
+    """
+    Splits documents into chunks identified by the SHA-256 of their content.
+
+    Args:
+        documents (Iterable[Document]): The documents to split.
+
+    Returns:
+        List[Document]: The chunks, in document order.
+    """
+    chunks = RecursiveCharacterTextSplitter(
+        chunk_size=500, chunk_overlap=100
+    ).split_documents(documents)
+    # the splitter does not carry IDs over, so hash each chunk's own text
+    for chunk in chunks:
+        chunk.id = content_hash(chunk.page_content)
+    return chunks
+
+
+def source_metadata(filename: str) -> dict:
+    """
+    Returns the metadata every chunk of an ingested file carries: its source
+    name and the time of ingestion.
+    """
+    created_at = datetime.now()
+    return {
+        "source": filename,
+        "creationdate": created_at.isoformat(),
+        # numeric copy of creationdate, as range filters need numbers
+        "creation_timestamp": created_at.timestamp(),
+    }
+
+
+def metadata_values(column: pd.Series) -> List:
+    """
+    Converts a column to Chroma metadata values: numpy scalars become Python
+    scalars and missing values become None, as Chroma drops NaN values.
+
+    Args:
+        column (pd.Series): The column to convert.
+
+    Returns:
+        List: One value per row.
+    """
+    return [
+        None if missing else value
+        for value, missing in zip(column.tolist(), column.isna().tolist())
+    ]
+
+
+def pdf_metadata(info: dict) -> dict:
+    """
+    Normalises PDF document info the way `PyPDFLoader` does: keys lose their
+    leading "/" and are lower-cased, dates become ISO strings, other values are
+    kept as str or int, and `page_count` and `file_path` are also copied to
+    `total_pages` and `source`.
+
+    Args:
+        info (dict): The document info, with the loader's defaults.
+
+    Returns:
+        dict: The page metadata shared by every page.
+    """
+    aliases = {"page_count": "total_pages", "file_path": "source"}
+    metadata = {}
+    for key, value in info.items():
+        if type(value) not in (str, int):
+            value = str(value)
+        key = key.removeprefix("/").lower()
+        if key in ("creationdate", "moddate"):
+            try:
+                metadata[key] = datetime.strptime(
+                    value.replace("'", ""), "D:%Y%m%d%H%M%S%z"
+                ).isoformat("T")
+            except ValueError:
+                metadata[key] = value
+        elif key in aliases:
+            metadata[aliases[key]] = value
+            metadata[key] = value
+        elif isinstance(value, str):
+            metadata[key] = value.strip()
+        else:
+            metadata[key] = value
+    return metadata
+
+
+def extract_pdf_pages(file_path: str, start: int, stop: int) -> List[Document]:
+    """
+    Extracts the pages `start` to `stop` (exclusive) of a PDF, with the same
+    metadata `PyPDFLoader` attaches to them.
+
+    Args:
+        file_path (str): Path of the PDF.
+        start (int): Index of the first page.
+        stop (int): Index after the last page.
+
+    Returns:
+        List[Document]: One document per page.
+    """
+    reader = PdfReader(file_path)
+    metadata = pdf_metadata(
+        {"producer": "PyPDF", "creator": "PyPDF", "creationdate": ""}
+        | dict(reader.metadata or {})
+        | {"source": file_path, "total_pages": len(reader.pages)}
+    )
+    return [
+        Document(
+            page_content=reader.pages[page].extract_text().strip(),
+            metadata=metadata | {"page": page, "page_label": reader.page_labels[page]},
+        )
+        for page in range(start, stop)
+    ]
+
+
+def extract_pdf_chunks(
+    file_path: str, start: int, stop: int, metadata: dict
+) -> List[Document]:
+    """
+    Extracts the pages `start` to `stop` (exclusive) of a PDF and splits them,
+    so a pool worker hands back finished chunks in one round trip.
+
+    Args:
+        file_path (str): Path of the PDF.
+        start (int): Index of the first page.
+        stop (int): Index after the last page.
+        metadata (dict): Set on every page before splitting, as
+            `DataIngestionPipeline.pre_processing_text` does.
+
+    Returns:
+        List[Document]: The chunks of the pages, in page order.
+    """
+    pages = extract_pdf_pages(file_path, start, stop)
+    for page in pages:
+        page.metadata.update(metadata)
+    return split_documents(pages)
+
+
+# PDF process pool "cache"
+_PDF_EXECUTOR: ProcessPoolExecutor | None = None
+_PDF_EXECUTOR_LOCK = threading.Lock()
+
+
+def get_pdf_executor() -> ProcessPoolExecutor:
+    """
+    Returns the process pool used to extract and chunk PDFs, starting it on first
+    use. Its size is set by `PDF_WORKERS` and defaults to one less than the
+    number of CPUs, leaving a core to the event loop and embedding.
+    """
+    global _PDF_EXECUTOR
+
+    if _PDF_EXECUTOR:
+        return _PDF_EXECUTOR
+
+    with _PDF_EXECUTOR_LOCK:
+        if _PDF_EXECUTOR is None:
+            workers = int(os.getenv("PDF_WORKERS") or max(1, (os.cpu_count() or 1) - 1))
+            # spawn, as forking a process that runs threads is unsafe
+            _PDF_EXECUTOR = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+
+    return _PDF_EXECUTOR
+
+
+def shutdown_pdf_executor():
+    """
+    Stops the PDF process pool if it has been started.
+    """
+    global _PDF_EXECUTOR
+
+    with _PDF_EXECUTOR_LOCK:
+        if _PDF_EXECUTOR is not None:
+            _PDF_EXECUTOR.shutdown()
+            _PDF_EXECUTOR = None
 
 
 class DataIngestionPipeline:
@@ -26,7 +210,18 @@ class DataIngestionPipeline:
     A class to handle the data ingestion pipeline.
 
     Attributes:
-        embedding_model (SentenceTransformer): The model used for text embedding.
+        db (VectorDB): The vector store chunks are written to. Defaults to the
+            process-wide instance returned by `get_vector_db`.
+        batch_size (int): Number of chunks embedded and upserted at a time. CSVs
+            are also read this many rows at a time, so peak memory depends on the
+            batch size rather than on the file size.
+        pdf_pages_per_task (int): PDFs longer than this are extracted and chunked
+            on the PDF process pool, this many pages per task.
+        timings (dict[str, float]): Seconds spent in each stage of `run`, updated
+            as the pipeline progresses.
+        chunk_counts (dict[str, int]): Chunks processed so far, how many of them
+            were new to the vector store, and how many chunks of a previous
+            version of the file were deleted.
     """
 
     def __init__(
@@ -35,79 +230,131 @@ class DataIngestionPipeline:
         filename: str,
         file_type: str,
         column_name: Optional[str] = None,
+        db: Optional[VectorDB] = None,
     ):
         self.file_path = file_path
         self.filename = filename
         self.file_type = file_type
         self.column_name = column_name
-        self.db = VectorDB()
+        self.db = db or get_vector_db()
+        self.batch_size = int(os.getenv("INGEST_BATCH_SIZE", 1000))
+        self.pdf_pages_per_task = int(os.getenv("PDF_PAGES_PER_TASK", 20))
+        # embedding and upsert are the parts of vectorstore spent writing new chunks
+        self.timings = {
+            "read_file": 0.0,
+            "create_chunks": 0.0,
+            "vectorstore": 0.0,
+            "embedding": 0.0,
+            "upsert": 0.0,
+        }
+        self.chunk_counts = {"processed": 0, "added": 0, "removed": 0}
+        self.throughput = {"chunks_per_second": 0.0, "embedded_chunks_per_second": 0.0}
         self._logger = get_logger()
 
-    def read_file(self) -> Union[List[Document], DataFrame]:
+    def read_file(
+        self,
+    ) -> Union[List[Document], Iterator[DataFrame], Iterator[List[Document]]]:
         """
         Reads the file based on its type and returns the data.
 
         Returns:
-            Union[List[Document], DataFrame]: The data read from the file.
+            Union[List[Document], Iterator[DataFrame], Iterator[List[Document]]]:
+                The data read from the file. CSVs are returned as a lazy iterator
+                of row chunks, long PDFs as the chunks of each page range.
         """
         if self.file_type == "text/csv":
             self._logger.info(
                 {
                     "application": "DataIngestionPipeline",
-                    "datetime": datetime.now().isoformat(),
                     "action": "Reading CSV",
                 }
             )
-            return pd.read_csv(self.file_path)
+            return pd.read_csv(self.file_path, chunksize=self.batch_size)
         elif self.file_type == "text/plain":
             self._logger.info(
                 {
                     "application": "DataIngestionPipeline",
-                    "datetime": datetime.now().isoformat(),
                     "action": "Reading Plain text file",
                 }
             )
+            from langchain_community.document_loaders import TextLoader
+
             return TextLoader(self.file_path).load()
         elif self.file_type == "application/pdf":
             self._logger.info(
                 {
                     "application": "DataIngestionPipeline",
-                    "datetime": datetime.now().isoformat(),
                     "action": "Reading PDF file",
                 }
             )
-            return PyPDFLoader(self.file_path).load()
+            return self.read_pdf()
         else:
             self._logger.error(
                 {
                     "application": "DataIngestionPipeline",
-                    "datetime": datetime.now().isoformat(),
                     "error": f"{self.file_type}",
                 }
             )
             raise ValueError("Unsupported file type. Use 'csv', 'text', or 'pdf'.")
 
+    def read_pdf(self) -> Union[List[Document], Iterator[List[Document]]]:
+        """
+        Extracts the pages of a PDF. Long documents are divided into page ranges
+        that are extracted and chunked in parallel on the PDF process pool.
+
+        Returns:
+            Union[List[Document], Iterator[List[Document]]]: One document per
+                page, or for PDFs longer than `pdf_pages_per_task` the chunks of
+                each page range; both in page order.
+        """
+        total_pages = len(PdfReader(self.file_path).pages)
+        if total_pages <= self.pdf_pages_per_task:
+            from langchain_community.document_loaders import PyPDFLoader
+
+            return PyPDFLoader(self.file_path).load()
+
+        starts = range(0, total_pages, self.pdf_pages_per_task)
+        stops = [min(start + self.pdf_pages_per_task, total_pages) for start in starts]
+        return get_pdf_executor().map(
+            extract_pdf_chunks,
+            repeat(str(self.file_path)),
+            starts,
+            stops,
+            repeat(source_metadata(self.filename)),
+        )
+
     def pre_processing_csv(
         self, filename: str, data: DataFrame, column_name: str
     ) -> List[Document]:
         self._logger.info(
             {
                 "application": "DataIngestionPipeline",
-                "datetime": datetime.now().isoformat(),
                 "action": "Started CSV preprocessing",
             }
         )
+        shared = source_metadata(filename)
+        texts = data[column_name].tolist()
+        ids = list(map(content_hash, texts))
+
+        # metadata is assembled column by column; only columns with missing
+        # values need a per-row check
+        columns = data.drop(columns=column_name)
+        missing = columns.isna().any()
+        dense = [name for name in columns.columns if not missing[name]]
+        metadata = [
+            dict(zip(dense, row))
+            for row in zip(*(columns[name].tolist() for name in dense))
+        ] or [{} for _ in texts]
+        for name in columns.columns[missing.to_numpy()]:
+            for meta, value in zip(metadata, metadata_values(columns[name])):
+                if value is not None:
+                    meta[name] = value
+        for meta in metadata:
+            meta.update(shared)
+
         return [
-            Document(
-                id=hashlib.sha256(desc.encode("utf-8")).hexdigest(),
-                page_content=desc,
-                metadata={
-                    **{k: v for k, v in row.items() if k != column_name},
-                    "source": filename,
-                    "creationdate": datetime.now().isoformat(),
-                },
-            )
-            for desc, row in zip(data[column_name], data.to_dict(orient="records"))
+            Document(id=doc_id, page_content=text, metadata=meta)
+            for doc_id, text, meta in zip(ids, texts, metadata)
         ]
 
     def pre_processing_text(
@@ -116,40 +363,45 @@ class DataIngestionPipeline:
         self._logger.info(
             {
                 "application": "DataIngestionPipeline",
-                "datetime": datetime.now().isoformat(),
                 "action": f"Starting {self.file_type} preprocessing",
             }
         )
+        metadata = source_metadata(filename)
         for doc in data:
-            doc.id = hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest()
-            doc.metadata["source"] = filename
-            doc.metadata["creationdate"] = datetime.now().isoformat()
+            doc.id = content_hash(doc.page_content)
+            doc.metadata.update(metadata)
 
         return data
 
-    def create_chunks(self, data: Union[List[Document], DataFrame]) -> List[Document]:
+    def create_chunks(
+        self,
+        data: Union[List[Document], Iterator[DataFrame], Iterator[List[Document]]],
+    ) -> Iterable[Document]:
         if self.file_type == "text/csv":
-            return self.pre_processing_csv(
-                filename=self.filename, data=data, column_name=self.column_name
+            # lazily build documents one row chunk at a time
+            return (
+                doc
+                for frame in data
+                for doc in self.pre_processing_csv(
+                    filename=self.filename, data=frame, column_name=self.column_name
+                )
             )
         elif self.file_type in ["text/plain", "application/pdf"]:
             self._logger.info(
                 {
                     "application": "DataIngestionPipeline",
-                    "datetime": datetime.now().isoformat(),
                     "action": "Chunking document",
                 }
             )
-            return RecursiveCharacterTextSplitter(
-                chunk_size=500, chunk_overlap=100
-            ).split_documents(
-                self.pre_processing_text(filename=self.filename, data=data)
-            )
+            if not isinstance(data, list):
+                # long PDFs are chunked by the pool workers that extracted them
+                return (chunk for chunks in data for chunk in chunks)
+            documents = self.pre_processing_text(filename=self.filename, data=data)
+            return split_documents(documents)
         else:
             self._logger.info(
                 {
                     "application": "DataIngestionPipeline",
-                    "datetime": datetime.now().isoformat(),
                     "action": "Chunking document",
                 }
             )
@@ -159,20 +411,79 @@ class DataIngestionPipeline:
         self._logger.info(
             {
                 "application": "DataIngestionPipeline",
-                "datetime": datetime.now().isoformat(),
                 "action": "DataIngestionPipeline started",
             }
         )
-        data = self.read_file()
-        chunks = self.create_chunks(data)
         start_time = datetime.now()
-        self.db.add_to_vectorstore(chunks)
+        start = perf_counter()
+        with self._timed("read_file"):
+            data = self.read_file()
+        with self._timed("create_chunks"):
+            batches = batched(self.create_chunks(data), self.batch_size)
+        # chunk IDs are staged in the manifest batch by batch; chunks of the
+        # previous version of this file are neither embedded nor written again
+        with self._timed("vectorstore"):
+            run = self.db.begin_source(self.filename)
+        batch_number = 0
+        while True:
+            # CSV rows are read and chunked lazily while batches are drawn
+            with self._timed("create_chunks"):
+                batch = next(batches, None)
+            if batch is None:
+                break
+            batch_number += 1
+            with self._timed("vectorstore"):
+                known_ids = self.db.stage_source(
+                    run, self.filename, [doc.id for doc in batch]
+                )
+                new_chunks = [doc for doc in batch if doc.id not in known_ids]
+                added = (
+                    self.db.add_to_vectorstore(new_chunks, timings=self.timings)
+                    if new_chunks
+                    else 0
+                )
+            self.chunk_counts["processed"] += len(batch)
+            self.chunk_counts["added"] += added
+            self._update_throughput(perf_counter() - start)
+            self._logger.info(
+                {
+                    "application": "DataIngestionPipeline",
+                    "action": f"Batch {batch_number} done - "
+                    f"{self.chunk_counts['processed']} chunks processed, "
+                    f"{self.chunk_counts['added']} added, "
+                    f"{self.throughput['chunks_per_second']:.1f} chunks/s",
+                }
+            )
+        with self._timed("vectorstore"):
+            self.chunk_counts["removed"] = self.db.replace_source(run, self.filename)
+        self._update_throughput(perf_counter() - start)
+        for stage, seconds in self.timings.items():
+            INGEST_STAGE_SECONDS.observe(seconds, stage=stage)
+        for outcome, count in self.chunk_counts.items():
+            INGEST_CHUNKS.inc(count, outcome=outcome)
         end_time = datetime.now()
         self._logger.info(
             {
                 "application": "DataIngestionPipeline",
-                "datetime": datetime.now().isoformat(),
                 "action": f"Total time taken for processing ingestion pipeline - {end_time-start_time} /s",  # noqa: E501
             }
         )
         return
+
+    def _update_throughput(self, elapsed: float):
+        self.throughput["chunks_per_second"] = (
+            self.chunk_counts["processed"] / elapsed if elapsed else 0.0
+        )
+        # new chunks per second of embedding, cache lookups included
+        if self.timings["embedding"]:
+            self.throughput["embedded_chunks_per_second"] = (
+                self.chunk_counts["added"] / self.timings["embedding"]
+            )
+
+    @contextmanager
+    def _timed(self, stage: str):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[stage] += perf_counter() - start
@@ -0,0 +1,376 @@
+"""
+EMBEDDING
+
+Wrappers placed in front of the embedding model returned by `get_embedding_model`.
+
+    - QueryBatcher: groups concurrent `embed_query` calls into one batched call
+    - EmbeddingScheduler: embeds documents in length-sorted batches sized to a
+      token budget, so little compute is spent on padding
+    - CachedEmbeddings: persists document embeddings on disk, keyed by model
+      name and text hash, so identical text is never embedded twice
+"""
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+from pathlib import Path
+from time import monotonic, time
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from src.sqlite import chunked_in_query
+from src.utils import base_path, content_hash, get_logger
+
+# Queue marker used to stop the batching thread
+_STOP = object()
+
+
+class QueryBatcher(Embeddings):
+    """
+    Micro-batches query embeddings.
+
+    Queries submitted from concurrent threads are collected for up to
+    `window_ms` milliseconds (or until `max_batch_size` queries are waiting) and
+    embedded with a single `embed_documents` call on the wrapped model. Each
+    caller blocks until its own vector is available. Document embeddings are
+    passed straight through.
+
+    Attributes:
+        model (Embeddings): The wrapped embedding model.
+        window_ms (float): How long to wait for more queries once one arrives.
+        max_batch_size (int): Upper bound on queries embedded in one call.
+    """
+
+    def __init__(
+        self,
+        model: Embeddings,
+        window_ms: float | None = None,
+        max_batch_size: int | None = None,
+    ):
+        self.model = model
+        self.window_ms = (
+            window_ms
+            if window_ms is not None
+            else float(os.getenv("QUERY_BATCH_WINDOW_MS", 5))
+        )
+        self.max_batch_size = max_batch_size or int(
+            os.getenv("QUERY_BATCH_MAX_SIZE", 32)
+        )
+        self._queue: queue.Queue = queue.Queue()
+        self._logger = get_logger()
+        self._thread = threading.Thread(
+            target=self._worker, name="query-batcher", daemon=True
+        )
+        self._thread.start()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.model.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        future: Future = Future()
+        self._queue.put((text, future))
+        return future.result()
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embeds several queries at once, bypassing the batching window.
+
+        Args:
+            texts (List[str]): The queries to embed.
+
+        Returns:
+            List[List[float]]: One vector per query, in input order.
+        """
+        if not texts:
+            return []
+        return self.model.embed_documents(texts)
+
+    def close(self):
+        """
+        Stops the batching thread once queued queries have been served.
+        """
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _collect(self) -> tuple[list, bool]:
+        """
+        Blocks for the first query, then gathers more until the window closes.
+        """
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+
+        batch = [first]
+        deadline = monotonic() + self.window_ms / 1000
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - monotonic()
+            try:
+                item = (
+                    self._queue.get(timeout=timeout)
+                    if timeout > 0
+                    else self._queue.get_nowait()
+                )
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _worker(self):
+        stop = False
+        while not stop:
+            batch, stop = self._collect()
+            if not batch:
+                continue
+            texts = [text for text, _ in batch]
+            try:
+                vectors = self.model.embed_documents(texts)
+            except Exception as e:
+                self._logger.error(
+                    {
+                        "application": "QueryBatcher",
+                        "error": e,
+                    }
+                )
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+
+class EmbeddingScheduler(Embeddings):
+    """
+    Embeds documents in length-bucketed batches.
+
+    Texts are sorted by estimated token count and cut into batches whose padded
+    size, the batch length times the token count of its longest text, stays
+    within `token_budget`. Short CSV rows are therefore embedded many at a time
+    and long PDF chunks a few at a time, both with little padding, and the
+    memory a model call needs stays bounded. Vectors are returned in input
+    order. Queries pass straight through.
+
+    Attributes:
+        model (Embeddings): The wrapped embedding model.
+        token_budget (int): Maximum padded tokens per model call.
+        max_batch_size (int): Maximum texts per model call.
+        max_tokens (int): Tokens the model keeps per text; longer texts are
+            truncated by the model and budgeted at this length.
+    """
+
+    # rough characters per token of English text with a WordPiece vocabulary
+    CHARS_PER_TOKEN = 4
+
+    def __init__(
+        self,
+        model: Embeddings,
+        token_budget: int | None = None,
+        max_batch_size: int | None = None,
+        max_tokens: int = 512,
+    ):
+        self.model = model
+        self.token_budget = token_budget or int(
+            os.getenv("EMBEDDING_TOKEN_BUDGET", 16384)
+        )
+        self.max_batch_size = max_batch_size or int(
+            os.getenv("EMBEDDING_MAX_BATCH_SIZE", 256)
+        )
+        self.max_tokens = max_tokens
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = [None] * len(texts)
+        for batch in self.batches(texts):
+            embeddings = self.model.embed_documents([texts[i] for i in batch])
+            for i, vector in zip(batch, embeddings):
+                vectors[i] = vector
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.model.embed_query(text)
+
+    def batches(self, texts: List[str]) -> List[List[int]]:
+        """
+        Groups texts into model calls.
+
+        Args:
+            texts (List[str]): The texts to embed.
+
+        Returns:
+            List[List[int]]: Indices into `texts` of each batch, shortest texts
+                first.
+        """
+        tokens = [self.estimate_tokens(text) for text in texts]
+        batches, batch = [], []
+        for i in sorted(range(len(texts)), key=tokens.__getitem__):
+            # sorted ascending, so the text being added is the batch's longest
+            if batch and (
+                len(batch) >= self.max_batch_size
+                or (len(batch) + 1) * tokens[i] > self.token_budget
+            ):
+                batches.append(batch)
+                batch = []
+            batch.append(i)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def estimate_tokens(self, text: str) -> int:
+        # two extra tokens for the [CLS] and [SEP] markers
+        return min(len(text) // self.CHARS_PER_TOKEN + 2, self.max_tokens)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Persistent on-disk cache for document embeddings.
+
+    Vectors are stored as float32 blobs in SQLite, keyed by (model name,
+    SHA-256 of the text). Rebuilding the Chroma directory, renaming the
+    collection or loading the same text into another collection reuses the
+    stored vectors instead of running the model again. When the cache holds
+    more than `max_entries` vectors the least recently used ones are evicted.
+    Queries are not cached here and go straight to the wrapped model.
+
+    Attributes:
+        model (Embeddings): The wrapped embedding model.
+        model_name (str): Name of the model the vectors belong to.
+        path (Path): Location of the SQLite database.
+        max_entries (int): Maximum number of stored vectors.
+    """
+
+    def __init__(
+        self,
+        model: Embeddings,
+        model_name: str,
+        path: str | Path | None = None,
+        max_entries: int | None = None,
+    ):
+        self.model = model
+        self.model_name = model_name
+        self.path = Path(
+            path
+            or os.getenv("EMBEDDING_CACHE_PATH")
+            or base_path / "local_model" / "embedding_cache.sqlite"
+        )
+        self.max_entries = max_entries or int(
+            os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 1_000_000)
+        )
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, hash TEXT NOT NULL, vector BLOB NOT NULL, "
+            "last_used REAL NOT NULL, PRIMARY KEY (model, hash))"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used "
+            "ON embeddings (last_used)"
+        )
+        self._conn.commit()
+        self._count = self._row_count()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [content_hash(text) for text in texts]
+        vectors = self._lookup(list(set(hashes)))
+
+        missing = {}
+        for text_hash, text in zip(hashes, texts):
+            if text_hash not in vectors:
+                missing.setdefault(text_hash, text)
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            computed = self.model.embed_documents(list(missing.values()))
+            new_vectors = dict(zip(missing, computed))
+            self._store(new_vectors)
+            vectors.update(new_vectors)
+
+        return [list(vectors[text_hash]) for text_hash in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.model.embed_query(text)
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return self.model.embed_queries(texts)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": self._count,
+            "maxsize": self.max_entries,
+        }
+
+    def close(self):
+        """
+        Closes the wrapped model and the SQLite connection.
+        """
+        close = getattr(self.model, "close", None)
+        if close is not None:
+            close()
+        with self._lock:
+            self._conn.close()
+
+    def _lookup(self, hashes: List[str]) -> dict[str, List[float]]:
+        found = {}
+        now = time()
+        with self._lock:
+            for text_hash, blob in chunked_in_query(
+                self._conn,
+                "SELECT hash, vector FROM embeddings "
+                "WHERE model = ? AND hash IN ({placeholders})",
+                hashes,
+                params=[self.model_name],
+            ):
+                found[text_hash] = np.frombuffer(blob, dtype=np.float32).tolist()
+            if found:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND hash = ?",
+                    [(now, self.model_name, text_hash) for text_hash in found],
+                )
+                self._conn.commit()
+        return found
+
+    def _store(self, vectors: dict[str, List[float]]):
+        now = time()
+        with self._lock:
+            # a vector another thread stored meanwhile is the same, so it is kept
+            inserted = self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, hash, vector, last_used) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (
+                        self.model_name,
+                        text_hash,
+                        np.asarray(vector, dtype=np.float32).tobytes(),
+                        now,
+                    )
+                    for text_hash, vector in vectors.items()
+                ],
+            )
+            # counted from the rows written, as a COUNT(*) scans the whole table
+            self._count += inserted.rowcount
+            overflow = self._count - self.max_entries
+            if overflow > 0:
+                evicted = self._conn.execute(
+                    "DELETE FROM embeddings WHERE rowid IN "
+                    "(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (overflow,),
+                ).rowcount
+                self.evictions += evicted
+                self._count -= evicted
+            self._conn.commit()
+
+    def _row_count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
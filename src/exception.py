@@ -2,5 +2,30 @@ class EmbeddingModelError(Exception):
     def __init__(self, message):
         self.message = message
         super().__init__(
-            f"Unsupported embedding model: '{message}'. Only Huggingface and OpenAI models are supported."  # noqa: E501
+            f"Unsupported embedding model: '{message}'. Only Huggingface, OpenAI and ONNX models are supported."  # noqa: E501
+        )
+
+
+class IngestionQueueFullError(Exception):
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        super().__init__(
+            f"Ingestion queue is full ({max_size} jobs waiting). Retry later."
+        )
+
+
+class AdmissionRejectedError(Exception):
+    def __init__(self, pool: str, reason: str, status_code: int, retry_after: int):
+        self.pool = pool
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = retry_after
+        super().__init__(f"Too many {pool} requests ({reason}). Retry later.")
+
+
+class VectorStoreError(Exception):
+    def __init__(self, message):
+        self.message = message
+        super().__init__(
+            f"Unsupported vector store: '{message}'. Only chroma and flat are supported."  # noqa: E501
         )
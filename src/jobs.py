@@ -0,0 +1,166 @@
+"""
+INGESTION JOBS
+
+A bounded queue of ingestion jobs served by a pool of worker threads, so parsing
+and embedding uploads never runs on the event loop. Every job gets an ID whose
+status, per-stage timings and chunk counts can be looked up while it runs.
+"""
+import os
+import queue
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Optional
+
+from src.exception import IngestionQueueFullError
+from src.metrics import INGEST_JOBS, Gauge
+from src.model import IngestionJob
+from src.utils import get_logger
+
+# Queue marker used to stop a worker thread
+_STOP = object()
+
+
+class IngestionJobQueue:
+    """
+    Runs ingestion jobs on a fixed pool of worker threads.
+
+    Attributes:
+        workers (int): Number of worker threads.
+        max_size (int): Maximum number of jobs waiting to run.
+        history (int): Number of finished jobs kept for status lookups.
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        max_size: Optional[int] = None,
+        history: Optional[int] = None,
+    ):
+        self.workers = workers or int(os.getenv("INGEST_WORKERS", 2))
+        self.max_size = max_size or int(os.getenv("INGEST_QUEUE_SIZE", 100))
+        self.history = history or int(os.getenv("INGEST_JOB_HISTORY", 1000))
+        self._queue: queue.Queue = queue.Queue(maxsize=self.max_size)
+        self._jobs: OrderedDict[str, IngestionJob] = OrderedDict()
+        self._lock = threading.Lock()
+        self._logger = get_logger()
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"ingest-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, job: IngestionJob, task: Callable[[IngestionJob], None]):
+        """
+        Queues a job for execution.
+
+        Args:
+            job (IngestionJob): The job to track.
+            task (Callable[[IngestionJob], None]): Does the work for the job.
+
+        Raises:
+            IngestionQueueFullError: If `max_size` jobs are already waiting.
+        """
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        try:
+            self._queue.put_nowait((job, task))
+        except queue.Full:
+            with self._lock:
+                self._jobs.pop(job.id, None)
+            raise IngestionQueueFullError(self.max_size)
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def depth(self) -> int:
+        """
+        Returns the number of jobs waiting to run.
+        """
+        return self._queue.qsize()
+
+    def shutdown(self):
+        """
+        Stops the workers after the queued jobs have been processed.
+        """
+        for _ in self._threads:
+            self._queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+
+    def _prune(self):
+        finished = [
+            job_id
+            for job_id, job in self._jobs.items()
+            if job.status in ("completed", "failed")
+        ]
+        for job_id in finished[: max(len(finished) - self.history, 0)]:
+            del self._jobs[job_id]
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            job, task = item
+            job.status = "running"
+            job.started_at = datetime.now()
+            try:
+                task(job)
+                job.status = "completed"
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e)
+                self._logger.error(
+                    {
+                        "application": "IngestionJobQueue",
+                        "job_id": job.id,
+                        "error": e,
+                    }
+                )
+            finally:
+                job.finished_at = datetime.now()
+                INGEST_JOBS.inc(status=job.status)
+
+
+# JOB QUEUE "cache"
+_JOB_QUEUE: IngestionJobQueue | None = None
+_JOB_QUEUE_LOCK = threading.Lock()
+
+
+def get_job_queue() -> IngestionJobQueue:
+    """
+    Returns the process-wide ingestion job queue, starting it on first use.
+    """
+    global _JOB_QUEUE
+
+    if _JOB_QUEUE:
+        return _JOB_QUEUE
+
+    with _JOB_QUEUE_LOCK:
+        if _JOB_QUEUE is None:
+            _JOB_QUEUE = IngestionJobQueue()
+
+    return _JOB_QUEUE
+
+
+INGEST_QUEUE_DEPTH = Gauge(
+    "ingest_queue_depth",
+    "Ingestion jobs waiting for a worker.",
+    callback=lambda: {(): _JOB_QUEUE.depth()} if _JOB_QUEUE else {},
+)
+
+
+def shutdown_job_queue():
+    """
+    Stops the process-wide ingestion job queue if it has been started.
+    """
+    global _JOB_QUEUE
+
+    with _JOB_QUEUE_LOCK:
+        if _JOB_QUEUE is not None:
+            _JOB_QUEUE.shutdown()
+            _JOB_QUEUE = None
@@ -0,0 +1,229 @@
+"""
+LEXICAL INDEX
+
+A persisted inverted index over chunk text, scored with BM25. It complements the
+embedding search for keyword-heavy queries such as product identifiers or SKUs,
+which dense embeddings tend to miss.
+"""
+import math
+import re
+import sqlite3
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Iterable, List
+
+from langchain.schema import Document
+
+from src.sqlite import ThreadLocalConnections, chunked_in_query
+
+# Words, numbers and identifiers such as "AB-1234" or "v2.1" are kept whole
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+
+# Function words carry no signal for BM25 but have the longest posting lists
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it of on or that the this "
+    "to was were will with".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class LexicalIndex(ThreadLocalConnections):
+    """
+    BM25 inverted index stored in SQLite.
+
+    Postings are written incrementally as chunks are added, so a query only reads
+    the postings of its own terms instead of scanning documents. Query stopwords
+    and terms found in more than `max_df_ratio` of the documents are dropped, as
+    their posting lists are the longest while their BM25 weight is close to zero;
+    the remaining postings are scored and ranked inside SQLite.
+
+    Attributes:
+        path (Path): Location of the SQLite database.
+        k1 (float): BM25 term frequency saturation.
+        b (float): BM25 document length normalisation.
+        max_df_ratio (float): Share of documents above which a query term is
+            dropped, unless every term of the query is that common.
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        k1: float = 1.5,
+        b: float = 0.75,
+        max_df_ratio: float = 0.2,
+    ):
+        self.path = Path(path)
+        self.k1 = k1
+        self.b = b
+        self.max_df_ratio = max_df_ratio
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        super().__init__(self.path)
+        self._write_lock = threading.Lock()
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents "
+            "(doc_id TEXT PRIMARY KEY, length INTEGER NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS postings (term TEXT NOT NULL, "
+            "doc_id TEXT NOT NULL, tf INTEGER NOT NULL, PRIMARY KEY (term, doc_id)) "
+            "WITHOUT ROWID"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS postings_doc_id ON postings (doc_id)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS terms "
+            "(term TEXT PRIMARY KEY, df INTEGER NOT NULL) WITHOUT ROWID"
+        )
+        if conn.execute("SELECT NOT EXISTS (SELECT 1 FROM terms)").fetchone()[0]:
+            # indexes written before document frequencies were kept
+            conn.execute(
+                "INSERT INTO terms SELECT term, COUNT(*) FROM postings GROUP BY term"
+            )
+        conn.commit()
+        self._doc_count, self._total_length = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM documents"
+        ).fetchone()
+
+    def add(self, documents: Iterable[Document]):
+        """
+        Indexes documents that are not indexed yet, keyed by their ID.
+
+        Args:
+            documents (Iterable[Document]): Documents with their `id` set.
+        """
+        documents = {doc.id: doc for doc in documents}
+        with self._write_lock:
+            conn = self._connection()
+            indexed = self._indexed_ids(conn, list(documents))
+            new_documents = [
+                doc for doc_id, doc in documents.items() if doc_id not in indexed
+            ]
+            if not new_documents:
+                return
+
+            rows, postings = [], []
+            for doc in new_documents:
+                terms = Counter(tokenize(doc.page_content))
+                rows.append((doc.id, sum(terms.values())))
+                postings.extend((term, doc.id, tf) for term, tf in terms.items())
+            conn.executemany("INSERT INTO documents VALUES (?, ?)", rows)
+            conn.executemany("INSERT INTO postings VALUES (?, ?, ?)", postings)
+            conn.executemany(
+                "INSERT INTO terms VALUES (?, ?) "
+                "ON CONFLICT (term) DO UPDATE SET df = df + excluded.df",
+                Counter(term for term, _, _ in postings).items(),
+            )
+            conn.commit()
+            self._doc_count += len(rows)
+            self._total_length += sum(length for _, length in rows)
+
+    def remove(self, ids: List[str]):
+        """
+        Removes documents from the index.
+
+        Args:
+            ids (List[str]): IDs of the documents to remove.
+        """
+        with self._write_lock:
+            conn = self._connection()
+            removed = chunked_in_query(
+                conn,
+                "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM documents "
+                "WHERE doc_id IN ({placeholders})",
+                ids,
+            )
+            conn.executemany(
+                "UPDATE terms SET df = df - ? WHERE term = ?",
+                [
+                    (count, term)
+                    for term, count in chunked_in_query(
+                        conn,
+                        "SELECT term, COUNT(*) FROM postings "
+                        "WHERE doc_id IN ({placeholders}) GROUP BY term",
+                        ids,
+                    )
+                ],
+            )
+            chunked_in_query(
+                conn, "DELETE FROM postings WHERE doc_id IN ({placeholders})", ids
+            )
+            chunked_in_query(
+                conn, "DELETE FROM documents WHERE doc_id IN ({placeholders})", ids
+            )
+            self._doc_count -= sum(count for count, _ in removed)
+            self._total_length -= sum(length for _, length in removed)
+            conn.execute("DELETE FROM terms WHERE df <= 0")
+            conn.commit()
+
+    def search(self, query: str, k: int) -> List[tuple[str, float]]:
+        """
+        Returns the `k` documents with the highest BM25 score for the query.
+
+        Args:
+            query (str): The search query.
+            k (int): Number of results.
+
+        Returns:
+            List[tuple[str, float]]: Document IDs and scores, best first.
+        """
+        terms = [
+            term for term in dict.fromkeys(tokenize(query)) if term not in STOPWORDS
+        ]
+        if not terms or not self._doc_count:
+            return []
+
+        conn = self._connection()
+        document_frequency = sorted(
+            chunked_in_query(
+                conn, "SELECT term, df FROM terms WHERE term IN ({placeholders})", terms
+            ),
+            key=lambda row: row[1],
+        )
+        if not document_frequency:
+            return []
+        max_df = self.max_df_ratio * self._doc_count
+        # keeps the rarest term when all of them are common
+        document_frequency = [
+            (term, df) for term, df in document_frequency if df <= max_df
+        ] or document_frequency[:1]
+
+        weights = [
+            (term, math.log(1 + (self._doc_count - df + 0.5) / (df + 0.5)))
+            for term, df in document_frequency
+        ]
+        average_length = self._total_length / self._doc_count
+        values = ",".join("(?, ?)" for _ in weights)
+        return conn.execute(
+            f"WITH query (term, idf) AS (VALUES {values}) "
+            f"SELECT p.doc_id, SUM(q.idf * p.tf * ? / (p.tf + ? * (? + ? * d.length))) "
+            f"AS score FROM query q JOIN postings p ON p.term = q.term "
+            f"JOIN documents d ON d.doc_id = p.doc_id "
+            f"GROUP BY p.doc_id ORDER BY score DESC LIMIT ?",
+            [value for weight in weights for value in weight]
+            + [
+                self.k1 + 1,
+                self.k1,
+                1 - self.b,
+                self.b / average_length,
+                k,
+            ],
+        ).fetchall()
+
+    def close(self):
+        with self._write_lock:
+            self._close_connections()
+
+    def _indexed_ids(self, conn: sqlite3.Connection, ids: List[str]) -> set[str]:
+        return {
+            row[0]
+            for row in chunked_in_query(
+                conn,
+                "SELECT doc_id FROM documents WHERE doc_id IN ({placeholders})",
+                ids,
+            )
+        }
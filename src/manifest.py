@@ -0,0 +1,187 @@
+"""
+SOURCE MANIFEST
+
+Records which chunk IDs each ingested source produced, so that re-ingesting an
+edited file can tell which chunks were added and which became stale. Chunk IDs
+are content hashes shared across sources, so a chunk is only reported as
+orphaned once no source references it anymore.
+
+The chunk IDs of a new version are staged in SQLite batch by batch and compared
+with the previous version there, so no complete set of IDs is held in memory.
+"""
+import sqlite3
+import threading
+import uuid
+from pathlib import Path
+from typing import Iterator, List
+
+from src.sqlite import chunked_in_query
+
+
+class SourceManifest:
+    """
+    Mapping of source name to chunk IDs, stored in SQLite.
+
+    A new version of a source is recorded with `begin`, one `stage` call per
+    batch of chunk IDs and a final `replace`; the chunks it orphaned are then
+    read back with `orphaned`.
+
+    Attributes:
+        path (Path): Location of the SQLite database.
+    """
+
+    # orphaned chunks handed out for deletion at a time
+    _ORPHANED_BATCH_SIZE = 500
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks (source TEXT NOT NULL, "
+            "chunk_id TEXT NOT NULL, PRIMARY KEY (source, chunk_id)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_id ON chunks (chunk_id)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS staged (run TEXT NOT NULL, "
+            "chunk_id TEXT NOT NULL, PRIMARY KEY (run, chunk_id)) WITHOUT ROWID"
+        )
+        # chunks whose last source was replaced, kept until they are deleted
+        # from the store so an interrupted deletion is resumed
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS orphaned (chunk_id TEXT PRIMARY KEY) "
+            "WITHOUT ROWID"
+        )
+        # runs of an earlier process can no longer be completed
+        self._conn.execute("DELETE FROM staged")
+        self._conn.commit()
+
+    def has_source(self, source: str) -> bool:
+        """
+        Returns whether any chunk is recorded for a source.
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT EXISTS (SELECT 1 FROM chunks WHERE source = ?)", (source,)
+            ).fetchone()[0]
+
+    def record(self, source: str, chunk_ids: List[str]):
+        """
+        Adds chunk IDs to those recorded for a source.
+        """
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO chunks VALUES (?, ?)",
+                [(source, chunk_id) for chunk_id in chunk_ids],
+            )
+            self._conn.commit()
+
+    def begin(self) -> str:
+        """
+        Starts staging the chunk IDs of a new version of a source.
+
+        Returns:
+            str: Identifier of the run, passed to `stage` and `replace`.
+        """
+        return uuid.uuid4().hex
+
+    def stage(self, run: str, source: str, chunk_ids: List[str]) -> set[str]:
+        """
+        Stages a batch of chunk IDs of the new version of a source.
+
+        Args:
+            run (str): Identifier returned by `begin`.
+            source (str): The source name.
+            chunk_ids (List[str]): IDs of a batch of chunks.
+
+        Returns:
+            set[str]: The IDs of the batch already recorded for the source.
+        """
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO staged VALUES (?, ?)",
+                [(run, chunk_id) for chunk_id in chunk_ids],
+            )
+            self._conn.commit()
+            return {
+                row[0]
+                for row in chunked_in_query(
+                    self._conn,
+                    "SELECT chunk_id FROM chunks WHERE source = ? "
+                    "AND chunk_id IN ({placeholders})",
+                    chunk_ids,
+                    params=[source],
+                )
+            }
+
+    def replace(self, run: str, source: str):
+        """
+        Records the staged chunk IDs as the complete set of chunks of a source.
+        Chunks of the previous version that no source references anymore are
+        added to those returned by `orphaned`.
+
+        Args:
+            run (str): Identifier returned by `begin`.
+            source (str): The source name.
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO orphaned SELECT chunk_id FROM chunks c "
+                "WHERE source = ? AND NOT EXISTS (SELECT 1 FROM staged s "
+                "WHERE s.run = ? AND s.chunk_id = c.chunk_id)",
+                (source, run),
+            )
+            self._conn.execute(
+                "DELETE FROM chunks WHERE source = ? AND chunk_id IN "
+                "(SELECT chunk_id FROM chunks WHERE source = ? "
+                "EXCEPT SELECT chunk_id FROM staged WHERE run = ?)",
+                (source, source, run),
+            )
+            self._conn.execute(
+                "INSERT OR IGNORE INTO chunks "
+                "SELECT ?, chunk_id FROM staged WHERE run = ?",
+                (source, run),
+            )
+            self._conn.execute("DELETE FROM staged WHERE run = ?", (run,))
+            self._conn.commit()
+
+    def orphaned(self) -> Iterator[List[str]]:
+        """
+        Yields batches of chunk IDs that no source references anymore. A batch
+        is forgotten once the next one is requested, so the caller deletes each
+        batch from the store before asking for more.
+
+        Yields:
+            List[str]: Up to `_ORPHANED_BATCH_SIZE` orphaned chunk IDs.
+        """
+        with self._lock:
+            # chunks that another source references again are not deleted
+            self._conn.execute(
+                "DELETE FROM orphaned WHERE EXISTS (SELECT 1 FROM chunks c "
+                "WHERE c.chunk_id = orphaned.chunk_id)"
+            )
+            self._conn.commit()
+        while True:
+            with self._lock:
+                batch = [
+                    row[0]
+                    for row in self._conn.execute(
+                        "SELECT chunk_id FROM orphaned LIMIT ?",
+                        (self._ORPHANED_BATCH_SIZE,),
+                    )
+                ]
+            if not batch:
+                return
+            yield batch
+            with self._lock:
+                self._conn.executemany(
+                    "DELETE FROM orphaned WHERE chunk_id = ?",
+                    [(chunk_id,) for chunk_id in batch],
+                )
+                self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,17 +1,45 @@
-import time
+from time import perf_counter
 
-from fastapi import Request
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+from src.metrics import HTTP_REQUEST_SECONDS
 
-class ProcessTimeMiddleware(BaseHTTPMiddleware):
+
+class ProcessTimeMiddleware:
     """
-    Middleware to add process time header to the response.
+    Middleware to add process time header to the response and record the
+    request duration, labelled by route template rather than raw path.
+
+    Written as plain ASGI rather than on `BaseHTTPMiddleware`, which runs every
+    request in an extra task and streams the response body through a queue.
     """
 
-    async def dispatch(self, request: Request, call_next):
-        start = time.time()
-        response = await call_next(request)
-        duration = time.time() - start
-        response.headers["X-Process-Time"] = f"{duration:.3f}s"
-        return response
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = perf_counter()
+        status_code = 500
+
+        async def send_with_time(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append("X-Process-Time", f"{perf_counter() - start:.3f}s")
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_time)
+        finally:
+            HTTP_REQUEST_SECONDS.observe(
+                perf_counter() - start,
+                method=scope["method"],
+                path=getattr(scope.get("route"), "path", "unmatched"),
+                status=status_code,
+            )
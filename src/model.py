@@ -1,9 +1,60 @@
+from datetime import datetime
+from typing import Annotated, List, Literal, Optional, Union
+from uuid import uuid4
+
 from langchain.schema import Document
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, StrictBool, StrictFloat, StrictInt
+
+
+class RetrieveDocFilter(BaseModel):
+    source: Optional[List[str]] = Field(default=None, min_length=1)
+    created_after: Optional[datetime] = None
+    created_before: Optional[datetime] = None
+    # equality on any other metadata field, e.g. CSV columns; keys starting
+    # with "$" would be read as `where` operators
+    metadata: dict[
+        Annotated[str, Field(pattern=r"^[^$]")],
+        Union[StrictBool, StrictInt, StrictFloat, str],
+    ] = Field(default_factory=dict)
+
+    def to_where(self) -> Optional[dict]:
+        """
+        Converts the filter into a Chroma `where` clause, so it is applied as a
+        pre-filter by the vector search.
+        """
+        clauses = [{key: {"$eq": value}} for key, value in self.metadata.items()]
+        if self.source:
+            clauses.append({"source": {"$in": self.source}})
+        if self.created_after:
+            clauses.append(
+                {"creation_timestamp": {"$gte": self.created_after.timestamp()}}
+            )
+        if self.created_before:
+            clauses.append(
+                {"creation_timestamp": {"$lte": self.created_before.timestamp()}}
+            )
+
+        if not clauses:
+            return None
+        if len(clauses) == 1:
+            return clauses[0]
+        return {"$and": clauses}
 
 
 class RetrieveDocInput(BaseModel):
     query: str
+    # bounded, as one admitted request must not hold a search slot indefinitely
+    top_k: Optional[int] = Field(default=None, ge=1, le=100)
+    filters: Optional[RetrieveDocFilter] = None
+    # "hybrid" also ranks chunks by BM25 keyword matches
+    mode: Literal["vector", "hybrid"] = "vector"
+
+    def where(self) -> Optional[dict]:
+        return self.filters.to_where() if self.filters else None
+
+
+class BatchRetrieveDocInput(BaseModel):
+    queries: List[RetrieveDocInput] = Field(min_length=1, max_length=64)
 
 
 class VectorDBDocument(BaseModel):
@@ -20,3 +71,19 @@ class VectorDBDocument(BaseModel):
             metadata=doc[0].metadata,
             score=round(doc[1], 2),
         )
+
+
+class IngestionJob(BaseModel):
+    id: str = Field(default_factory=lambda: uuid4().hex)
+    filename: str
+    file_type: str
+    status: Literal["queued", "running", "completed", "failed"] = "queued"
+    created_at: datetime = Field(default_factory=datetime.now)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    # seconds spent per pipeline stage
+    stages: dict[str, float] = Field(default_factory=dict)
+    chunks: dict[str, int] = Field(default_factory=dict)
+    # chunks per second overall and per second spent embedding
+    throughput: dict[str, float] = Field(default_factory=dict)
+    error: Optional[str] = None
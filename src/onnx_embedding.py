@@ -0,0 +1,119 @@
+"""
+ONNX EMBEDDING
+
+CPU embedding backend running an ONNX export of the sentence-transformers
+model (optionally int8-quantized) with ONNX Runtime, selected with
+`EMBEDDING_MODEL=onnx`. It reproduces the e5 pipeline of `HuggingFaceEmbeddings`
+(BERT encoder, mean pooling over non-padding tokens, L2 normalisation), so its
+vectors can be searched against a collection built with the PyTorch model.
+
+onnxruntime and tokenizers are imported on use, so they are only needed when
+this backend is configured.
+"""
+from pathlib import Path
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    Sentence embeddings computed with ONNX Runtime.
+
+    Texts are tokenized in one batch call, sorted by token count and embedded
+    `batch_size` at a time, so each batch is padded only to the length of its
+    own longest text.
+
+    Attributes:
+        model_path (Path): The `.onnx` file; `tokenizer.json` is read from the
+            same directory.
+        model_name (str): Name keying cached vectors of this model.
+        batch_size (int): Texts per model call.
+        max_length (int): Tokens kept per text, longer texts are truncated.
+    """
+
+    def __init__(
+        self,
+        model_path: str | Path,
+        model_name: str,
+        batch_size: int = 32,
+        max_length: int = 512,
+        intra_op_threads: int = 0,
+    ):
+        """
+        Args:
+            model_path (str | Path): The `.onnx` file to load.
+            model_name (str): Name keying cached vectors of this model.
+            batch_size (int): Texts per model call.
+            max_length (int): Tokens kept per text.
+            intra_op_threads (int): Threads ONNX Runtime uses within an
+                operator, 0 for its default of one per physical core.
+        """
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        self.model_path = Path(model_path)
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_length = max_length
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        self.session = onnxruntime.InferenceSession(
+            str(self.model_path),
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        self._input_names = {node.name for node in self.session.get_inputs()}
+        outputs = [node.name for node in self.session.get_outputs()]
+        self._output_name = (
+            "last_hidden_state" if "last_hidden_state" in outputs else outputs[0]
+        )
+
+        self.tokenizer = Tokenizer.from_file(
+            str(self.model_path.parent / "tokenizer.json")
+        )
+        # batches are padded here, to the longest text of each batch only
+        self.tokenizer.no_padding()
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self._pad_id = self.tokenizer.token_to_id("[PAD]") or 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        encodings = self.tokenizer.encode_batch(texts)
+        order = sorted(range(len(texts)), key=lambda i: len(encodings[i].ids))
+        vectors = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start : start + self.batch_size]
+            embeddings = self._embed([encodings[i].ids for i in batch])
+            for i, vector in zip(batch, embeddings.tolist()):
+                vectors[i] = vector
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def _embed(self, token_ids: List[List[int]]) -> np.ndarray:
+        length = max(len(ids) for ids in token_ids)
+        input_ids = np.full((len(token_ids), length), self._pad_id, dtype=np.int64)
+        attention_mask = np.zeros((len(token_ids), length), dtype=np.int64)
+        for row, ids in enumerate(token_ids):
+            input_ids[row, : len(ids)] = ids
+            attention_mask[row, : len(ids)] = 1
+
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+        hidden = self.session.run([self._output_name], feeds)[0]
+
+        # exports that already pool return one vector per text
+        if hidden.ndim == 3:
+            mask = attention_mask[..., None].astype(hidden.dtype)
+            hidden = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        norms = np.linalg.norm(hidden, axis=1, keepdims=True)
+        return hidden / np.maximum(norms, 1e-12)
@@ -0,0 +1,47 @@
+"""
+RESPONSES
+
+JSON responses rendered straight to bytes. `orjson` is used when installed (it
+ships with chromadb), with the standard library as fallback. Pydantic models are
+encoded from their field values, without a `model_dump` copy per object.
+"""
+import json
+from datetime import date, datetime
+from typing import Any
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, BaseModel):
+        return obj.__dict__
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """
+    Encodes content as compact UTF-8 JSON.
+    """
+    if orjson is not None:
+        return orjson.dumps(content, default=_default)
+    return json.dumps(
+        content, default=_default, ensure_ascii=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    `JSONResponse` encoded with `dumps`, so it accepts Pydantic models anywhere
+    in the content.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -1,20 +1,56 @@
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
-from datetime import datetime
 from pathlib import Path
+from time import perf_counter
 from typing import List
 
-from fastapi import APIRouter, BackgroundTasks, Form, UploadFile, status
+from fastapi import APIRouter, Form, UploadFile, status
 from fastapi.responses import JSONResponse
 
-from src.model import RetrieveDocInput, VectorDBDocument
+from src.admission import (
+    ADMISSION_REJECTIONS,
+    retrieval_admission_from_env,
+    upload_admission_from_env,
+)
+from src.exception import IngestionQueueFullError
+from src.jobs import get_job_queue
+from src.metrics import RETRIEVAL_STAGE_SECONDS, Gauge, timed
+from src.model import (
+    BatchRetrieveDocInput,
+    IngestionJob,
+    RetrieveDocInput,
+    VectorDBDocument,
+)
+from src.responses import FastJSONResponse
 from src.service import DataIngestionService
-from src.utils import VectorDB, clean_folder, get_logger
+from src.utils import (
+    RETRIEVAL_LOGGER,
+    VectorDB,
+    get_logger,
+    get_vector_db,
+    workspace_root,
+)
+
+retrieval_admission = retrieval_admission_from_env()
+upload_admission = upload_admission_from_env()
+# one thread per running search; admission control bounds what waits for them
+executor = ThreadPoolExecutor(
+    max_workers=retrieval_admission.max_concurrency, thread_name_prefix="retrieval"
+)
+
+EXECUTOR_WORKERS = Gauge(
+    "retrieval_executor_workers",
+    "Maximum number of retrieval executor threads.",
+    callback=lambda: {(): executor._max_workers},
+)
+EXECUTOR_QUEUED = Gauge(
+    "retrieval_executor_queued",
+    "Retrieval calls waiting for a free executor thread.",
+    callback=lambda: {(): executor._work_queue.qsize()},
+)
 
-executor = ThreadPoolExecutor()
-
-base_path = Path(__file__).parent.parent
 logger = get_logger()
+retrieval_logger = get_logger(RETRIEVAL_LOGGER)
 
 
 ingestion = APIRouter(tags=["Ingestion"])
@@ -23,26 +59,30 @@ retrieval = APIRouter(tags=["Document Retrieval"])
 ALLOWED_TYPES = ["application/pdf", "text/csv", "text/plain"]
 
 
+async def open_vector_db() -> VectorDB:
+    """
+    Returns the shared VectorDB. While it is still being opened at startup the
+    wait happens on a worker thread, so the event loop is never blocked.
+    """
+    return get_vector_db(create=False) or await asyncio.to_thread(get_vector_db)
+
+
 @ingestion.post("/ingest")
-async def ingest_data(
-    file: UploadFile, background_task: BackgroundTasks, column_name: str = Form(None)
-):
+async def ingest_data(file: UploadFile, column_name: str = Form(None)):
     logger.info(
         {
             "application": "IngestionRouter",
-            "datetime": datetime.now(),
             "action": "Ingestion Pipeline Triggered",
         }
     )
     if file.content_type not in ALLOWED_TYPES:
-        logger.error(
+        logger.warning(
             {
                 "application": "IngestionRouter",
-                "datetime": datetime.now(),
                 "error": "Unsupported file received",
             }
         )
-        raise JSONResponse(
+        return JSONResponse(
             status_code=status.HTTP_400_BAD_REQUEST,
             content={
                 "message": "Unsupported file type. Please upload a PDF, CSV, or text file."  # noqa: E501
@@ -50,69 +90,138 @@ async def ingest_data(
         )
 
     if file.content_type == "text/csv" and column_name == "":
-        logger.error(
+        logger.warning(
             {
                 "application": "IngestionRouter",
-                "datetime": datetime.now(),
                 "error": "Required column name not provided",
             }
         )
-        raise JSONResponse(
+        return JSONResponse(
             status_code=status.HTTP_405_METHOD_NOT_ALLOWED,
             content={
                 "message": "Unprocessable CSV's require a column name for processing"
             },
         )
 
-    temporary_fp = base_path / "tmp"
-    file_path = temporary_fp / file.filename
+    with upload_admission.admit():
+        job = IngestionJob(filename=file.filename, file_type=file.content_type)
 
-    service = DataIngestionService(
-        file_path=file_path,
-        filename=file.filename,
-        file_type=file.content_type,
-        file=file,
-        column_name=column_name if file.content_type == "text/csv" else None,
-    )
+        # Every job gets its own workspace so concurrent uploads never collide
+        workspace = workspace_root() / job.id
+        workspace.mkdir(parents=True)
+        file_path = workspace / Path(file.filename).name
 
-    #  Storing the file in a temporary location for further processing
-    await service.tmp_file_write(file=file, file_path=file_path)
+        service = DataIngestionService(
+            file_path=file_path,
+            filename=file.filename,
+            file_type=file.content_type,
+            file=file,
+            column_name=column_name if file.content_type == "text/csv" else None,
+        )
 
-    # Running the ingestion pipeline in the background
-    logger.error(
+        #  Storing the file in a temporary location for further processing
+        start = perf_counter()
+        await service.tmp_file_write(file=file, file_path=file_path)
+        job.stages["upload"] = perf_counter() - start
+
+    # Queueing the ingestion pipeline; the worker removes the workspace when done
+    try:
+        get_job_queue().submit(job, service.run)
+    except IngestionQueueFullError as e:
+        service.cleanup()
+        ADMISSION_REJECTIONS.inc(pool="ingest_jobs", reason="limit")
+        logger.warning(
+            {
+                "application": "IngestionRouter",
+                "error": e,
+            }
+        )
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"message": str(e)},
+            headers={"Retry-After": str(upload_admission.retry_after)},
+        )
+    logger.info(
         {
             "application": "IngestionRouter",
-            "datetime": datetime.now(),
-            "action": "Background process started for ingestion",
+            "action": f"Ingestion job {job.id} queued",
         }
     )
-    background_task.add_task(service.run)
-
-    # Remove the file from the temporary storage location
-    background_task.add_task(clean_folder, temporary_fp)
 
     return JSONResponse(
-        content={"message": "Data ingestion pipeline initiated successfully."},
+        content={
+            "message": "Data ingestion pipeline initiated successfully.",
+            "job_id": job.id,
+        },
         status_code=202,
     )
 
 
+@ingestion.get("/ingest/{job_id}")
+async def get_ingestion_job(job_id: str) -> IngestionJob:
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={"message": f"Ingestion job {job_id} not found"},
+        )
+    return JSONResponse(
+        content=job.model_dump(mode="json"), status_code=status.HTTP_200_OK
+    )
+
+
 @retrieval.post("/retrieve/docs")
 async def get_documents(data: RetrieveDocInput) -> List[VectorDBDocument]:
-    service = VectorDB()
-    logger.info(
+    service = await open_vector_db()
+    retrieval_logger.info(
         {
             "application": "Retrieval router",
-            "datetime": datetime.now().isoformat(),
             "action": "Document retrieval started",
         }
     )
-    loop = asyncio.get_event_loop()
-    docs = await loop.run_in_executor(executor, service.retrieve_documents, data.query)
+    docs = await retrieval_admission.run(
+        executor,
+        service.retrieve_documents,
+        data.query,
+        data.top_k,
+        data.where(),
+        data.mode,
+    )
+    with timed(RETRIEVAL_STAGE_SECONDS, stage="serialization"):
+        return FastJSONResponse(
+            content={"documents": docs}, status_code=status.HTTP_200_OK
+        )
+
+
+@retrieval.post("/retrieve/docs/batch")
+async def get_documents_batch(
+    data: BatchRetrieveDocInput,
+) -> List[List[VectorDBDocument]]:
+    service = await open_vector_db()
+    retrieval_logger.info(
+        {
+            "application": "Retrieval router",
+            "action": f"Batch document retrieval started for {len(data.queries)} "
+            "queries",
+        }
+    )
+    results = await retrieval_admission.run(
+        executor,
+        service.retrieve_documents_batch,
+        [
+            (query.query, query.top_k, query.where(), query.mode)
+            for query in data.queries
+        ],
+    )
+    with timed(RETRIEVAL_STAGE_SECONDS, stage="serialization"):
+        return FastJSONResponse(
+            content={"results": [{"documents": docs} for docs in results]},
+            status_code=status.HTTP_200_OK,
+        )
+
+
+@retrieval.get("/retrieve/cache")
+async def get_cache_stats():
     return JSONResponse(
-        content={
-            # Explicit serialization due to customization
-            "documents": [i.model_dump() for i in docs]
-        },
-        status_code=status.HTTP_200_OK,
+        content=(await open_vector_db()).cache_stats(), status_code=status.HTTP_200_OK
     )
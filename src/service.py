@@ -1,7 +1,11 @@
-from datetime import datetime
+import asyncio
+import os
+import shutil
+from pathlib import Path
 from typing import Optional
 
 from src.data_ingestion import DataIngestionPipeline
+from src.model import IngestionJob
 from src.utils import get_logger
 
 
@@ -25,19 +29,44 @@ class DataIngestionService:
         self._logger.info(
             {
                 "application": "DataIngestionService",
-                "datetime": datetime.now(),
                 "action": "Writing file to Temporary directory",
             }
         )
+        # stream in fixed-size chunks so memory use does not grow with the upload
+        chunk_size = int(os.getenv("UPLOAD_CHUNK_SIZE", 1024 * 1024))
+        # disk writes run on a worker thread so a large upload never stalls the
+        # event loop serving searches
         with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
+            while chunk := await file.read(chunk_size):
+                await asyncio.to_thread(f.write, chunk)
 
-    async def run(self):
+    def cleanup(self):
+        """
+        Removes the job workspace holding the uploaded file.
+        """
+        shutil.rmtree(Path(self.file_path).parent, ignore_errors=True)
+
+    def run(self, job: IngestionJob):
+        """
+        Runs the ingestion pipeline for the uploaded file and removes its job
+        workspace afterwards. Called from an ingestion worker thread.
+
+        Args:
+            job (IngestionJob): The job whose timings and chunk counts are updated
+                while the pipeline runs.
+        """
         ingestion_service = DataIngestionPipeline(
             file_path=self.file_path,
             filename=self.filename,
             file_type=self.file_type,
             column_name=self.column_name,
         )
-        ingestion_service.run()
+        # share the pipeline's counters with the job so progress is visible live
+        ingestion_service.timings.update(job.stages)
+        job.stages = ingestion_service.timings
+        job.chunks = ingestion_service.chunk_counts
+        job.throughput = ingestion_service.throughput
+        try:
+            ingestion_service.run()
+        finally:
+            self.cleanup()
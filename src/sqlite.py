@@ -0,0 +1,69 @@
+"""
+SQLITE HELPERS
+
+Shared by the SQLite-backed indexes: per-thread connections, and `IN` queries
+over more values than one statement can bind.
+"""
+import sqlite3
+import threading
+from pathlib import Path
+from typing import List, Sequence
+
+# SQLite limits the number of bound parameters per statement
+MAX_PARAMETERS = 500
+
+
+def chunked_in_query(
+    conn: sqlite3.Connection, sql: str, values: Sequence, params: Sequence = ()
+) -> List[tuple]:
+    """
+    Runs a statement once per batch of `values` and returns the rows of all
+    batches.
+
+    Args:
+        conn (sqlite3.Connection): The connection to run the statement on.
+        sql (str): The statement, with a `{placeholders}` field where the `?`
+            marks of a batch go, e.g. "... WHERE id IN ({placeholders})".
+        values (Sequence): Values bound to the placeholders, at most
+            `MAX_PARAMETERS` at a time.
+        params (Sequence): Parameters bound before the batch in every run.
+
+    Returns:
+        List[tuple]: The rows returned by every run, in batch order.
+    """
+    rows = []
+    for start in range(0, len(values), MAX_PARAMETERS):
+        batch = values[start : start + MAX_PARAMETERS]
+        placeholders = ",".join("?" * len(batch))
+        rows.extend(
+            conn.execute(sql.replace("{placeholders}", placeholders), [*params, *batch])
+        )
+    return rows
+
+
+class ThreadLocalConnections:
+    """
+    Mixin opening one connection per thread to the same database, so searches
+    can read concurrently while a writer holds its own lock.
+    """
+
+    def __init__(self, path: str | Path):
+        self._database_path = Path(path)
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._database_path, check_same_thread=False)
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def _close_connections(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
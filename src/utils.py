@@ -1,164 +1,827 @@
+import atexit
+import hashlib
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import random
 import shutil
 import sys
+import threading
 from datetime import datetime
 from functools import lru_cache
 from pathlib import Path
-from typing import List
+from time import perf_counter
+from typing import Callable, List, Literal, Optional
 
-from chromadb.errors import DuplicateIDError
 from dotenv import load_dotenv
 from langchain.schema import Document
-from langchain_chroma import Chroma
-from langchain_community.embeddings import OpenAIEmbeddings
-from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_core.embeddings import Embeddings
 
+from src.cache import LRUCache
 from src.exception import EmbeddingModelError
+from src.lexical import LexicalIndex
+from src.manifest import SourceManifest
+from src.metrics import (
+    RETRIEVAL_STAGE_SECONDS,
+    VECTORSTORE_WRITE_SECONDS,
+    Counter,
+    Gauge,
+    timed,
+)
 from src.model import VectorDBDocument
+from src.vectorstore import get_vector_store
 
 load_dotenv()
 
+SearchMode = Literal["vector", "hybrid"]
+
+# Logger of per-request retrieval logs, which can be sampled at high request rates
+RETRIEVAL_LOGGER = "retrieval"
+
+# Rank offset of reciprocal rank fusion, as in the original RRF paper
+RRF_K = 60
+
 base_path = Path(__file__).parent.parent
 
 
 class VectorDB:
-    def __init__(self) -> None:
-        self.embedding_model = get_embedding_model()
-        self.db = Chroma(
-            collection_name=os.getenv("COLLECTION_NAME"),
-            embedding_function=self.embedding_model,
-            persist_directory=base_path / os.getenv("VECTOR_INDEX_NAME", "demo_db"),
+    """
+    Wrapper around the vector store collection used by the application.
+
+    A single instance is shared by the whole process (see `get_vector_db`), so the
+    vector store and the embedding model are opened once. Reads are safe to run
+    concurrently; writes are serialised with an internal lock.
+    """
+
+    def __init__(self, embedding_model: Optional[Embeddings] = None) -> None:
+        """
+        Args:
+            embedding_model (Optional[Embeddings]): Model used to embed chunks and
+                queries. Defaults to the one configured by `EMBEDDING_MODEL`.
+        """
+        # imported here as src.embedding depends on this module
+        from src.embedding import CachedEmbeddings, EmbeddingScheduler, QueryBatcher
+
+        model = embedding_model or get_embedding_model()
+        self.embedding_model = CachedEmbeddings(
+            QueryBatcher(EmbeddingScheduler(model)),
+            model_name=embedding_model_name(model),
+        )
+        persist_directory = base_path / os.getenv("VECTOR_INDEX_NAME", "demo_db")
+        collection_name = os.getenv("COLLECTION_NAME", "langchain")
+        self.store = get_vector_store(persist_directory, collection_name)
+        # kept with the store, so switching backends never pairs a manifest
+        # with a store that lacks its chunks
+        self.lexical_index = LexicalIndex(
+            self.store.directory / f"{collection_name}.lexical.sqlite"
+        )
+        self.manifest = SourceManifest(
+            self.store.directory / f"{collection_name}.manifest.sqlite"
+        )
+        self.hybrid_candidates = int(os.getenv("HYBRID_CANDIDATES", 50))
+        self._write_lock = threading.Lock()
+        self._closed = False
+        # bumped on every write so cached results of older generations are stale
+        self.generation = 0
+        self.query_embedding_cache = LRUCache(
+            maxsize=int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", 1024)),
+            ttl=float(os.getenv("QUERY_EMBEDDING_CACHE_TTL", 3600)),
+        )
+        self.query_result_cache = LRUCache(
+            maxsize=int(os.getenv("QUERY_RESULT_CACHE_SIZE", 1024)),
+            ttl=float(os.getenv("QUERY_RESULT_CACHE_TTL", 300)),
         )
         self._logger = get_logger()
+        self._retrieval_logger = get_logger(RETRIEVAL_LOGGER)
+
+    def health(self) -> dict:
+        """
+        Reports whether the underlying vector store is reachable.
+
+        Returns:
+            dict: Readiness flag and the number of indexed chunks.
+        """
+        if self._closed:
+            return {"ready": False, "error": "closed"}
+        try:
+            return {
+                "ready": True,
+                "vector_store": self.store.name,
+                "documents": self.store.count(),
+            }
+        except Exception as e:
+            return {"ready": False, "error": str(e)}
+
+    def warmup(self):
+        """
+        Runs one query embedding and, if the collection has chunks, one search,
+        so model weights and index files are loaded before the first request.
+        Caches are bypassed and left empty.
+        """
+        embedding = self.embedding_model.embed_queries(["warmup"])[0]
+        if self.store.count():
+            self._search([embedding], k=1)
+        self.lexical_index.search("warmup", k=1)
 
-    def add_to_vectorstore(self, documents: List[Document]):
+    def close(self):
+        """
+        Releases the vector store. The instance must not be used afterwards.
+        """
+        with self._write_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self.store.close()
+            self.embedding_model.close()
+            self.lexical_index.close()
+            self.manifest.close()
+        self._logger.info(
+            {
+                "application": "VectorDatabaseOperation",
+                "action": "Vector database closed",
+            }
+        )
+
+    def add_to_vectorstore(
+        self, documents: List[Document], timings: Optional[dict] = None
+    ) -> int:
         """
         Adds documents to the vector store.
 
+        Documents are keyed by their content-hash ID: duplicates within the batch
+        are collapsed and IDs already present in the collection are skipped, so
+        only unseen chunks are sent to the embedding model.
+
         Args:
             documents (List[Document]): The documents to add.
+            timings (Optional[dict]): If given, seconds spent embedding and
+                upserting are added to its "embedding" and "upsert" entries.
+
+        Returns:
+            int: The number of documents actually added.
         """
         self._logger.info(
             {
                 "application": "VectorDatabaseOperation",
-                "datetime": datetime.now(),
                 "action": "Adding chunks to vector database",
             }
         )
-        try:
-            self.db.add_documents(documents=documents)
-        except DuplicateIDError as e:
-            self._logger.error(
-                {
-                    "application": "VectorDatabaseOperation",
-                    "datetime": datetime.now(),
-                    "error": e,
-                }
-            )
-            return
+        unique_documents = {}
+        for doc in documents:
+            doc.id = doc.id or content_hash(doc.page_content)
+            unique_documents.setdefault(doc.id, doc)
+
+        with self._write_lock:
+            existing_ids = self.existing_ids(list(unique_documents))
+            new_documents = [
+                doc
+                for doc_id, doc in unique_documents.items()
+                if doc_id not in existing_ids
+            ]
+            batch_size = self.store.max_batch_size
+            for start in range(0, len(new_documents), batch_size):
+                batch = new_documents[start : start + batch_size]
+                texts = [doc.page_content for doc in batch]
+                # embedded here rather than by the store so both stages are timed
+                began = perf_counter()
+                embeddings = self.embedding_model.embed_documents(texts)
+                embedded = perf_counter()
+                self.store.upsert(
+                    ids=[doc.id for doc in batch],
+                    embeddings=embeddings,
+                    documents=texts,
+                    metadatas=[doc.metadata or None for doc in batch],
+                )
+                upserted = perf_counter()
+                for stage, seconds in (
+                    ("embedding", embedded - began),
+                    ("upsert", upserted - embedded),
+                ):
+                    VECTORSTORE_WRITE_SECONDS.observe(seconds, stage=stage)
+                    if timings is not None:
+                        timings[stage] = timings.get(stage, 0.0) + seconds
+            # also backfills chunks that were stored before the lexical index existed
+            self.lexical_index.add(unique_documents.values())
+            if new_documents:
+                self._bump_generation()
+
+        self._logger.info(
+            {
+                "application": "VectorDatabaseOperation",
+                "action": f"Added {len(new_documents)} chunks, skipped "
+                f"{len(documents) - len(new_documents)} duplicate or indexed chunks",
+            }
+        )
+        return len(new_documents)
 
-    def update_vectorstore(self, documents: List[Document]):
+    def existing_ids(self, ids: List[str]) -> set[str]:
         """
-        Updates the vector store with new documents.
+        Looks up which of the given IDs are already stored in the collection.
 
         Args:
-            documents (List[Document]): The documents to update.
+            ids (List[str]): The IDs to look up.
+
+        Returns:
+            set[str]: The subset of `ids` present in the collection.
         """
+        return set(self.store.filter_ids(ids))
+
+    def begin_source(self, source: str) -> str:
+        """
+        Starts recording a new version of a source.
+
+        Sources ingested before the manifest existed are first recorded from
+        the `source` metadata of their stored chunks.
+
+        Args:
+            source (str): The source name.
+
+        Returns:
+            str: Identifier of the run, passed to `stage_source` and
+                `replace_source`.
+        """
+        with self._write_lock:
+            if not self.manifest.has_source(source):
+                self.manifest.record(
+                    source, self.store.filter_ids(where={"source": source})
+                )
+        return self.manifest.begin()
+
+    def stage_source(self, run: str, source: str, chunk_ids: List[str]) -> set[str]:
+        """
+        Stages a batch of chunk IDs of the new version of a source.
+
+        Args:
+            run (str): Identifier returned by `begin_source`.
+            source (str): The source name.
+            chunk_ids (List[str]): IDs of a batch of chunks.
+
+        Returns:
+            set[str]: The IDs of the batch that the previous version of the
+                source already stored, so they need not be looked up again.
+                Chunks the manifest lists but the store lacks are left out, so
+                they are written again.
+        """
+        return self.existing_ids(list(self.manifest.stage(run, source, chunk_ids)))
+
+    def replace_source(self, run: str, source: str) -> int:
+        """
+        Records the staged chunks as the latest version of a source and deletes
+        chunks that only belonged to its earlier versions.
+
+        Args:
+            run (str): Identifier returned by `begin_source`. Every staged chunk
+                must already be stored.
+            source (str): The source name.
+
+        Returns:
+            int: The number of stale chunks deleted.
+        """
+        removed = 0
+        with self._write_lock:
+            self.manifest.replace(run, source)
+            for stale_ids in self.manifest.orphaned():
+                self._delete(stale_ids)
+                removed += len(stale_ids)
+
         self._logger.info(
             {
                 "application": "VectorDatabaseOperation",
-                "datetime": datetime.now(),
-                "action": "Adding chunks to existing vector database",
+                "action": f"Deleted {removed} stale chunks of {source}",
             }
         )
-        try:
-            self.add_to_vectorstore(documents)
-        except DuplicateIDError as e:
-            self._logger.error(
-                {
-                    "application": "VectorDatabaseOperation",
-                    "datetime": datetime.now(),
-                    "error": e,
-                }
-            )
-            return
+        return removed
 
-    def retrieve_documents(self, query: str) -> List[VectorDBDocument]:
-        self._logger.info(
+    def retrieve_documents(
+        self,
+        query: str,
+        top_k: Optional[int] = None,
+        where: Optional[dict] = None,
+        mode: SearchMode = "vector",
+    ) -> List[VectorDBDocument]:
+        """
+        Retrieves the chunks most similar to the query.
+
+        Query embeddings and result lists are cached; cached results are only
+        served while no documents have been added since they were computed.
+
+        Args:
+            query (str): The search query.
+            top_k (Optional[int]): Number of chunks to return. Defaults to the
+                `top_k` environment variable, or 3.
+            where (Optional[dict]): Chroma metadata filter applied before the
+                similarity search.
+            mode (SearchMode): "vector" for embedding search only, or "hybrid" to
+                fuse it with BM25 keyword search using reciprocal rank fusion.
+
+        Returns:
+            List[VectorDBDocument]: The matching chunks with relevance scores.
+        """
+        self._retrieval_logger.info(
             {
                 "application": "VectorDatabaseOperation",
-                "datetime": datetime.now(),
                 "action": "Retrieving chunks from vector database",
             }
         )
-        retrieved_documents = self.db.similarity_search_with_relevance_scores(
-            query=query, k=os.getenv("top_k", 3)
+        return self._retrieve(
+            [(query, top_k, where, mode)],
+            embed=lambda queries: [self.embedding_model.embed_query(queries[0])],
+        )[0]
+
+    def retrieve_documents_batch(
+        self, queries: List[tuple[str, Optional[int], Optional[dict], SearchMode]]
+    ) -> List[List[VectorDBDocument]]:
+        """
+        Retrieves the chunks most similar to each of several queries.
+
+        Uncached queries are embedded in one batched model call and searched with
+        one collection query per distinct filter.
+
+        Args:
+            queries (List[tuple[str, Optional[int], Optional[dict], SearchMode]]):
+                The query, number of chunks to return (None for the default),
+                Chroma metadata filter and search mode of each search.
+
+        Returns:
+            List[List[VectorDBDocument]]: The matching chunks of each query, in
+                input order.
+        """
+        self._retrieval_logger.info(
+            {
+                "application": "VectorDatabaseOperation",
+                "action": f"Retrieving chunks for {len(queries)} queries",
+            }
         )
-        return [VectorDBDocument.from_retrieved(i) for i in retrieved_documents]
+        return self._retrieve(queries, embed=self.embedding_model.embed_queries)
+
+    def cache_stats(self) -> dict:
+        """
+        Returns hit/miss/eviction counters of the query caches.
+        """
+        return {
+            "generation": self.generation,
+            "query_embedding": self.query_embedding_cache.stats(),
+            "query_result": self.query_result_cache.stats(),
+            "document_embedding": self.embedding_model.stats(),
+        }
+
+    def _retrieve(
+        self,
+        queries: List[tuple[str, Optional[int], Optional[dict], SearchMode]],
+        embed: Callable[[List[str]], List[List[float]]],
+    ) -> List[List[VectorDBDocument]]:
+        generation = self.generation
+        default_top_k = int(os.getenv("top_k", 3))
+        requests = [
+            (normalize_query(query), top_k or default_top_k, where_key(where), mode)
+            for query, top_k, where, mode in queries
+        ]
+        wheres = {
+            request[2]: where for request, (_, _, where, _) in zip(requests, queries)
+        }
+        results = [
+            self.query_result_cache.get((generation, *request)) for request in requests
+        ]
+        pending = [i for i, documents in enumerate(results) if documents is None]
+        if not pending:
+            return [list(documents) for documents in results]
+
+        embeddings = {
+            query: self.query_embedding_cache.get(query)
+            for query in dict.fromkeys(requests[i][0] for i in pending)
+        }
+        missing = [
+            query for query, embedding in embeddings.items() if embedding is None
+        ]
+        if missing:
+            with timed(RETRIEVAL_STAGE_SECONDS, stage="query_embedding"):
+                computed = embed(missing)
+            for query, embedding in zip(missing, computed):
+                embeddings[query] = embedding
+                self.query_embedding_cache.set(query, embedding)
+
+        # one collection query per distinct filter and search mode
+        groups: dict[tuple[str, SearchMode], List[int]] = {}
+        for i in pending:
+            groups.setdefault(requests[i][2:], []).append(i)
+        for (key, mode), indices in groups.items():
+            k = max(requests[i][1] for i in indices)
+            if mode == "hybrid":
+                k = max(k, self.hybrid_candidates)
+            with timed(RETRIEVAL_STAGE_SECONDS, stage="vector_search"):
+                searched = self._search(
+                    [embeddings[requests[i][0]] for i in indices],
+                    k=k,
+                    where=wheres[key],
+                )
+            for i, documents in zip(indices, searched):
+                query, top_k = requests[i][:2]
+                if mode == "hybrid":
+                    documents = self._fuse(query, documents, top_k, wheres[key])
+                results[i] = tuple(documents[:top_k])
+                self.query_result_cache.set((generation, *requests[i]), results[i])
+        return [list(documents) for documents in results]
+
+    def _search(
+        self, embeddings: List[List[float]], k: int, where: Optional[dict] = None
+    ) -> List[List[VectorDBDocument]]:
+        """
+        Runs one vector store search for all embeddings and returns the top `k`
+        chunks of each. `where` is applied before the nearest-neighbour search.
+        """
+        return [
+            [VectorDBDocument.from_retrieved(match) for match in matches]
+            for matches in self.store.search(embeddings, k=k, where=where)
+        ]
+
+    def _fuse(
+        self,
+        query: str,
+        vector_documents: List[VectorDBDocument],
+        top_k: int,
+        where: Optional[dict],
+    ) -> List[VectorDBDocument]:
+        """
+        Merges vector and BM25 rankings with reciprocal rank fusion. Scores are
+        scaled so a chunk ranked first by both searches scores 1.
+        """
+        with timed(RETRIEVAL_STAGE_SECONDS, stage="lexical_search"):
+            lexical_ids = [
+                doc_id
+                for doc_id, _ in self.lexical_index.search(
+                    query, k=self.hybrid_candidates
+                )
+            ]
+            if where is not None and lexical_ids:
+                allowed = set(self.store.filter_ids(lexical_ids, where=where))
+                lexical_ids = [doc_id for doc_id in lexical_ids if doc_id in allowed]
+
+        fused: dict[str, float] = {}
+        for ranking in ([doc.id for doc in vector_documents], lexical_ids):
+            for rank, doc_id in enumerate(ranking, 1):
+                fused[doc_id] = fused.get(doc_id, 0.0) + 1 / (RRF_K + rank)
+        top = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+        documents = {
+            doc.id: Document(
+                id=doc.id, page_content=doc.page_content, metadata=doc.metadata
+            )
+            for doc in vector_documents
+        }
+        missing = [doc_id for doc_id, _ in top if doc_id not in documents]
+        if missing:
+            for doc in self.store.get(missing):
+                documents[doc.id] = doc
+        best = 2 / (RRF_K + 1)
+        return [
+            VectorDBDocument.from_retrieved((documents[doc_id], score / best))
+            for doc_id, score in top
+            if doc_id in documents
+        ]
+
+    def _delete(self, ids: List[str]):
+        """
+        Deletes chunks from the collection and the lexical index. Callers hold
+        the write lock.
+        """
+        if not ids:
+            return
+        self.store.delete(ids)
+        self.lexical_index.remove(ids)
+        self._bump_generation()
+
+    def _bump_generation(self):
+        self.generation += 1
+        self.query_result_cache.clear()
+
+
+def content_hash(text: str) -> str:
+    """
+    Returns the SHA-256 hex digest used as the ID of a chunk with this text.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
 
-def clean_folder(folder_path: str | Path):
-    folder = Path(folder_path)
-    if not folder.exists() or not folder.is_dir():
-        raise ValueError(f"{folder} is not a valid folder")
+def normalize_query(query: str) -> str:
+    """
+    Normalizes a query for cache lookups by collapsing whitespace.
+    """
+    return " ".join(query.split())
+
+
+def where_key(where: Optional[dict]) -> str:
+    """
+    Returns a canonical string for a metadata filter, used in cache keys.
+    """
+    return json.dumps(where, sort_keys=True)
+
+
+# VECTOR DB "cache"
+_VECTOR_DB: VectorDB | None = None
+_VECTOR_DB_LOCK = threading.Lock()
+
+
+def get_vector_db(create: bool = True) -> Optional[VectorDB]:
+    """
+    Returns the process-wide VectorDB, opening it on first use.
+
+    Args:
+        create (bool): Open the database if it is not open yet.
 
-    for item in folder.iterdir():
+    Returns:
+        Optional[VectorDB]: The shared instance, or None when `create` is False
+        and the database has not been opened.
+    """
+    global _VECTOR_DB
+
+    if _VECTOR_DB or not create:
+        return _VECTOR_DB
+
+    with _VECTOR_DB_LOCK:
+        if _VECTOR_DB is None:
+            _VECTOR_DB = VectorDB()
+
+    return _VECTOR_DB
+
+
+def close_vector_db():
+    """
+    Closes the process-wide VectorDB if it has been opened.
+    """
+    global _VECTOR_DB
+
+    with _VECTOR_DB_LOCK:
+        if _VECTOR_DB is not None:
+            _VECTOR_DB.close()
+            _VECTOR_DB = None
+
+
+def _cache_stat(field: str) -> Callable[[], dict]:
+    def collect() -> dict:
+        db = _VECTOR_DB
+        if db is None:
+            return {}
+        stats = db.cache_stats()
+        return {
+            (cache,): stats[cache][field]
+            for cache in ("query_embedding", "query_result", "document_embedding")
+        }
+
+    return collect
+
+
+CACHE_HITS = Counter(
+    "cache_hits_total",
+    "Lookups answered from cache.",
+    labelnames=("cache",),
+    callback=_cache_stat("hits"),
+)
+CACHE_MISSES = Counter(
+    "cache_misses_total",
+    "Lookups that missed the cache.",
+    labelnames=("cache",),
+    callback=_cache_stat("misses"),
+)
+CACHE_EVICTIONS = Counter(
+    "cache_evictions_total",
+    "Entries evicted from cache.",
+    labelnames=("cache",),
+    callback=_cache_stat("evictions"),
+)
+CACHE_ENTRIES = Gauge(
+    "cache_entries",
+    "Entries currently held in cache.",
+    labelnames=("cache",),
+    callback=_cache_stat("size"),
+)
+
+
+@lru_cache(maxsize=1)
+def workspace_root() -> Path:
+    """
+    Returns the directory holding the job workspaces of this process,
+    `tmp/<pid>`, creating it on first use. A directory left behind by an
+    earlier process with the same PID is emptied then.
+    """
+    root = base_path / "tmp" / str(os.getpid())
+    shutil.rmtree(root, ignore_errors=True)
+    root.mkdir(parents=True)
+    return root
+
+
+def clean_stale_workspaces():
+    """
+    Removes job workspaces no running process can pick up again: those of
+    processes that have exited and any left from before workspaces were kept
+    per process. Workspaces of this process and of other running workers
+    sharing `tmp/` are kept.
+    """
+    own = workspace_root()
+    for item in own.parent.iterdir():
+        if item == own or (item.name.isdigit() and _process_running(int(item.name))):
+            continue
         try:
-            if item.is_file() or item.is_symlink():
-                item.unlink()  # Delete file or symlink
-            elif item.is_dir():
-                shutil.rmtree(item)  # Recursively delete subfolder
-        except Exception as e:
-            print(f"Failed to delete {item}: {e}")
+            if item.is_dir() and not item.is_symlink():
+                shutil.rmtree(item)
+            else:
+                item.unlink()
+        except OSError as e:
+            get_logger().warning({"application": "Startup", "error": e})
+
+
+def _process_running(pid: int) -> bool:
+    # signal 0 terminates the process on Windows, so there every PID is kept
+    if os.name == "nt":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
 
 
 @lru_cache(maxsize=1)
 def get_embedding_model():
+    # backends are imported on use, so only the configured one is ever loaded
     if os.getenv("EMBEDDING_MODEL") == "huggingface":
+        from langchain_huggingface import HuggingFaceEmbeddings
+
         return HuggingFaceEmbeddings(
             model_name=os.getenv("EMBEDDING_MODEL_NAME", "intfloat/e5-small-v2"),
             cache_folder=f'{base_path / "local_model" / "e5-small-v2"}',
+            # batches are sized by EmbeddingScheduler, so each runs as one pass
+            encode_kwargs={
+                "batch_size": int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", 256))
+            },
         )
     elif os.getenv("EMBEDDING_MODEL") == "openai":
+        from langchain_community.embeddings import OpenAIEmbeddings
+
         return OpenAIEmbeddings(
             api_key=os.getenv("OPENAI_API_KEY"),
             model=os.getenv("OPENAI_EMBEDDING_MODEL_NAME"),
         )
+    elif os.getenv("EMBEDDING_MODEL") == "onnx":
+        from src.onnx_embedding import OnnxEmbeddings
+
+        model_path = base_path / (
+            os.getenv("ONNX_MODEL_PATH") or "local_model/e5-small-v2-onnx/model.onnx"
+        )
+        return OnnxEmbeddings(
+            model_path=model_path,
+            # the file name tells fp32 and quantized exports apart in the cache
+            model_name=f'{os.getenv("EMBEDDING_MODEL_NAME", "intfloat/e5-small-v2")}'
+            f":onnx:{model_path.stem}",
+            batch_size=int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", 256)),
+            max_length=int(os.getenv("ONNX_MAX_LENGTH", 512)),
+            intra_op_threads=int(os.getenv("ONNX_INTRA_OP_THREADS") or 0),
+        )
     else:
         raise EmbeddingModelError(message=os.getenv("EMBEDDING_MODEL"))
 
 
+def embedding_model_name(model) -> str:
+    """
+    Returns a stable name for an embedding model, used to key cached vectors.
+    """
+    for attribute in ("model_name", "model"):
+        name = getattr(model, attribute, None)
+        if isinstance(name, str) and name:
+            return name
+    return type(model).__name__
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as one JSON object per line. Dict messages are merged into
+    the object, so the structured fields passed by callers stay queryable.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "level": record.levelname,
+            "datetime": datetime.fromtimestamp(record.created).isoformat(),
+            "logger": record.name,
+        }
+        if isinstance(record.msg, dict):
+            entry.update(record.msg)
+        else:
+            entry["message"] = record.getMessage()
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the background writer without formatting them, and drops
+    records instead of blocking when the queue is full.
+    """
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # formatting happens on the listener thread
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DeferredQueueHandler.dropped += 1
+
+
+LOG_RECORDS_DROPPED = Counter(
+    "log_records_dropped_total",
+    "Log records dropped because the log queue was full.",
+    callback=lambda: {(): DeferredQueueHandler.dropped},
+)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a random `rate` fraction of records below WARNING. Warnings and
+    errors always pass.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
 # LOGGER "cache"
 _LOGGER: logging.Logger | None = None
+_LOG_LISTENER: logging.handlers.QueueListener | None = None
 
 
 def init_logger(log_level: str = "DEBUG") -> logging.Logger:
     """
     Initialize the logger with the specified log level.
+
+    Records are put on a queue and formatted and written to stdout by a
+    background thread, so logging never blocks on I/O in the calling thread.
+    `LOG_FORMAT` selects "json" (default) or "text" output.
     """
     log_level = os.getenv("LOG_LEVEL", log_level)
-    global _LOGGER
+    global _LOGGER, _LOG_LISTENER
+
+    if _LOG_LISTENER is not None:
+        _LOG_LISTENER.stop()
 
-    logger = logging.root
     handler = logging.StreamHandler(sys.stdout)
-    handler.setFormatter(
-        logging.Formatter("%(levelname)s - %(asctime)s - %(name)s - %(message)s")
-    )
-    logger.handlers = [handler]
+    if os.getenv("LOG_FORMAT", "json") == "text":
+        handler.setFormatter(
+            logging.Formatter("%(levelname)s - %(asctime)s - %(name)s - %(message)s")
+        )
+    else:
+        handler.setFormatter(JsonFormatter())
+
+    log_queue: queue.Queue = queue.Queue(int(os.getenv("LOG_QUEUE_SIZE", 10000)))
+    _LOG_LISTENER = logging.handlers.QueueListener(log_queue, handler)
+    _LOG_LISTENER.start()
+
+    logger = logging.root
+    logger.handlers = [DeferredQueueHandler(log_queue)]
     logger.setLevel(log_level)
 
+    retrieval_logger = logging.getLogger(RETRIEVAL_LOGGER)
+    retrieval_logger.filters = [
+        SamplingFilter(float(os.getenv("RETRIEVAL_LOG_SAMPLE_RATE", 1)))
+    ]
+
     _LOGGER = logger
 
     return logger
 
 
-def get_logger() -> logging.Logger:
+def get_logger(name: Optional[str] = None) -> logging.Logger:
+    """
+    Returns the application logger, or one of its children when `name` is
+    given. Per-request retrieval logs go to the `RETRIEVAL_LOGGER` child, which
+    is sampled by `RETRIEVAL_LOG_SAMPLE_RATE`.
+    """
     global _LOGGER
 
-    if _LOGGER:
-        return _LOGGER
+    if not _LOGGER:
+        _LOGGER = init_logger()
+
+    return logging.getLogger(name) if name else _LOGGER
 
-    _LOGGER = init_logger()
 
-    return _LOGGER
+@atexit.register
+def shutdown_logger():
+    """
+    Writes out queued records and stops the background log writer.
+    """
+    global _LOG_LISTENER
+
+    if _LOG_LISTENER is not None:
+        _LOG_LISTENER.stop()
+        _LOG_LISTENER = None
@@ -0,0 +1,870 @@
+"""
+VECTOR STORES
+
+Backends holding the chunk vectors behind `VectorDB`, selected with the
+`VECTOR_STORE` environment variable:
+
+    - chroma: a persistent Chroma collection (default)
+    - flat: exact search over an append-only, memory-mapped float32 matrix, with
+      IDs, texts and metadata kept in a SQLite side table. With
+      `FLAT_QUANTIZATION=int8` only int8 codes are memory-mapped and scanned, a
+      quarter of the bytes, and the best `FLAT_RERANK_CANDIDATES` are re-ranked
+      exactly on float32 rows read from disk
+
+Both are given precomputed embeddings, accept Chroma `where` filters and report
+relevance scores on the same scale, so either can serve the same collection.
+
+With `VECTOR_STORE_SHARDS` above 1 the collection is split over that many
+stores of the configured backend, written and searched in parallel.
+"""
+import hashlib
+import heapq
+import itertools
+import json
+import math
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+from langchain.schema import Document
+
+from src.cache import LRUCache
+from src.exception import VectorStoreError
+from src.sqlite import ThreadLocalConnections, chunked_in_query
+
+# A retrieved chunk and its relevance score, higher is better
+Match = tuple[Document, float]
+
+
+class VectorStore(ABC):
+    """
+    Interface of a vector store backend. Writes are serialised by the caller;
+    reads may run concurrently with each other and with writes.
+
+    Attributes:
+        name (str): Value of `VECTOR_STORE` selecting the backend.
+        max_batch_size (int): Largest number of chunks per `upsert` call.
+        directory (Path): Directory of the store's files. Indexes kept next to
+            the vectors, such as the lexical index and source manifest, are
+            stored here so they always describe the chunks of this store.
+    """
+
+    name: str
+    max_batch_size: int
+    directory: Path
+
+    @abstractmethod
+    def count(self) -> int:
+        """
+        Returns the number of stored chunks.
+        """
+
+    @abstractmethod
+    def upsert(
+        self,
+        ids: List[str],
+        embeddings: List[List[float]],
+        documents: List[str],
+        metadatas: List[Optional[dict]],
+    ):
+        """
+        Stores chunks, replacing any stored under the same IDs.
+        """
+
+    @abstractmethod
+    def delete(self, ids: List[str]):
+        """
+        Deletes chunks. Unknown IDs are ignored.
+        """
+
+    @abstractmethod
+    def filter_ids(
+        self, ids: Optional[List[str]] = None, where: Optional[dict] = None
+    ) -> List[str]:
+        """
+        Returns the stored IDs among `ids` (all if None) matching `where`.
+        """
+
+    @abstractmethod
+    def get(self, ids: List[str]) -> List[Document]:
+        """
+        Returns the stored chunks with the given IDs, in no particular order.
+        """
+
+    @abstractmethod
+    def search(
+        self, embeddings: List[List[float]], k: int, where: Optional[dict] = None
+    ) -> List[List[Match]]:
+        """
+        Returns the `k` chunks nearest to each embedding, best first.
+        """
+
+    @abstractmethod
+    def close(self):
+        """
+        Releases the store's connections and files.
+        """
+
+
+class ChromaVectorStore(VectorStore):
+    """
+    Chroma collection persisted with a local `PersistentClient`.
+    """
+
+    name = "chroma"
+
+    def __init__(self, persist_directory: Path, collection_name: str):
+        # imported on use, so the flat backend never loads Chroma
+        import chromadb
+
+        self.directory = Path(persist_directory)
+        self.client = chromadb.PersistentClient(path=str(persist_directory))
+        # created as LangChain's `Chroma` wrapper did, so existing collections
+        # open unchanged; embeddings are always computed by the caller
+        self.collection = self.client.get_or_create_collection(
+            name=collection_name, embedding_function=None
+        )
+        self.max_batch_size = self.client.get_max_batch_size()
+
+    def count(self) -> int:
+        self.client.heartbeat()
+        return self.collection.count()
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        self.collection.upsert(
+            ids=ids, embeddings=embeddings, metadatas=metadatas, documents=documents
+        )
+
+    def delete(self, ids: List[str]):
+        for start in range(0, len(ids), self.max_batch_size):
+            self.collection.delete(ids=ids[start : start + self.max_batch_size])
+
+    def filter_ids(
+        self, ids: Optional[List[str]] = None, where: Optional[dict] = None
+    ) -> List[str]:
+        if ids is None:
+            return self.collection.get(where=where, include=[])["ids"]
+        found = []
+        for start in range(0, len(ids), self.max_batch_size):
+            batch = ids[start : start + self.max_batch_size]
+            found.extend(self.collection.get(ids=batch, where=where, include=[])["ids"])
+        return found
+
+    def get(self, ids: List[str]) -> List[Document]:
+        result = self.collection.get(ids=ids, include=["documents", "metadatas"])
+        return [
+            Document(id=doc_id, page_content=text, metadata=metadata or {})
+            for doc_id, text, metadata in zip(
+                result["ids"], result["documents"], result["metadatas"]
+            )
+        ]
+
+    def search(
+        self, embeddings: List[List[float]], k: int, where: Optional[dict] = None
+    ) -> List[List[Match]]:
+        # `where` is evaluated against Chroma's metadata indexes before the search
+        result = self.collection.query(
+            query_embeddings=embeddings,
+            n_results=k,
+            where=where,
+            include=["documents", "metadatas", "distances"],
+        )
+        return [
+            [
+                (
+                    Document(id=doc_id, page_content=text, metadata=metadata or {}),
+                    # squared L2 distance, Chroma's default space
+                    _relevance_score(1.0 - distance / 2.0),
+                )
+                for doc_id, text, metadata, distance in zip(*columns)
+            ]
+            for columns in zip(
+                result["ids"],
+                result["documents"],
+                result["metadatas"],
+                result["distances"],
+            )
+        ]
+
+    def close(self):
+        # `close` is only available on recent chromadb clients
+        close = getattr(self.client, "close", None)
+        if close is not None:
+            close()
+
+
+class FlatVectorStore(ThreadLocalConnections, VectorStore):
+    """
+    Exact nearest-neighbour search over L2-normalised float32 vectors.
+
+    Vectors are appended to `vectors.f32` and memory-mapped as one contiguous
+    matrix, so a search is a single matrix product followed by a partial sort.
+    Row numbers, IDs, texts and metadata live in `chunks.sqlite`. Replaced and
+    deleted chunks are only flagged as deleted; their rows stay in the file and
+    are masked out of searches.
+
+    With int8 quantization every row is also stored as int8 codes scaled by its
+    largest component (`vectors.i8` and `scales.f32`). Only the codes are
+    memory-mapped: searches scan them and read the float32 rows of the
+    shortlisted candidates from `vectors.f32` with plain file reads. The bytes
+    a search scans and keeps mapped shrink about fourfold, while the files on
+    disk grow by about a quarter. Codes missing for rows written without
+    quantization are computed when the store is opened.
+
+    Attributes:
+        directory (Path): Directory holding the vector files and side table.
+        quantization (Optional[str]): "int8", or None to scan float32 vectors.
+        rerank_candidates (int): Candidates per query re-ranked exactly when
+            quantized.
+    """
+
+    name = "flat"
+    max_batch_size = 4096
+
+    # rows converted to float32 at a time, small enough to stay in CPU cache
+    _SCAN_BLOCK = 1024
+
+    def __init__(
+        self,
+        directory: str | Path,
+        quantization: Optional[str] = None,
+        rerank_candidates: int = 200,
+    ):
+        if quantization not in (None, "int8"):
+            raise ValueError(f"Unsupported quantization: '{quantization}'")
+        self.directory = Path(directory)
+        self.quantization = quantization
+        self.rerank_candidates = rerank_candidates
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._vectors_path = self.directory / "vectors.f32"
+        self._codes_path = self.directory / "vectors.i8"
+        self._scales_path = self.directory / "scales.f32"
+        self._path = self.directory / "chunks.sqlite"
+        # rows matching recent filters, keyed by the write version they were read at
+        self._filter_cache = LRUCache(maxsize=64)
+        self._version = 0
+        super().__init__(self._path)
+        self._write_lock = threading.Lock()
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks (row INTEGER PRIMARY KEY, "
+            "id TEXT NOT NULL, document TEXT NOT NULL, metadata TEXT, "
+            "deleted INTEGER NOT NULL DEFAULT 0)"
+        )
+        conn.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS chunks_live_id ON chunks (id) "
+            "WHERE deleted = 0"
+        )
+        columns = {
+            column for _, column, *_ in conn.execute("PRAGMA table_info(chunks)")
+        }
+        for key in INDEXED_METADATA:
+            if key not in columns:
+                # untyped, so values compare exactly like `json_extract` results
+                conn.execute(f"ALTER TABLE chunks ADD COLUMN {key}")
+                conn.execute(
+                    f"UPDATE chunks SET {key} = json_extract(metadata, '$.{key}')"
+                )
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS chunks_{key} ON chunks ({key}) "
+                "WHERE deleted = 0"
+            )
+        conn.commit()
+        setting = conn.execute(
+            "SELECT value FROM settings WHERE key = 'dimensions'"
+        ).fetchone()
+        self.dimensions: Optional[int] = setting[0] if setting else None
+
+        # rows are only committed once their vectors are written, so a torn
+        # append leaves bytes past the last row, which are ignored
+        deleted = [
+            flag for (flag,) in conn.execute("SELECT deleted FROM chunks ORDER BY row")
+        ]
+        alive = np.array(deleted, dtype=bool) == 0
+        if self.quantization and len(alive):
+            self._backfill_codes(len(alive))
+        # readers take the matrices and the mask together from this one attribute
+        self._snapshot = (*self._map(len(alive)), alive)
+
+    def count(self) -> int:
+        return int(np.count_nonzero(self._snapshot[-1]))
+
+    def scan_bytes(self) -> int:
+        """
+        Returns the number of bytes of vector data an unfiltered search scans,
+        which are also the only vector bytes kept memory-mapped.
+        """
+        return sum(array.nbytes for array in self._snapshot[:-1] if array is not None)
+
+    def stored_bytes(self) -> int:
+        """
+        Returns the number of bytes of vector data on disk, codes included.
+        """
+        rows = len(self._snapshot[-1])
+        if not rows:
+            return 0
+        row_bytes = self.dimensions * 4
+        if self.quantization:
+            row_bytes += self.dimensions + 4
+        return rows * row_bytes
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        vectors = normalize(np.asarray(embeddings, dtype=np.float32))
+        with self._write_lock:
+            conn = self._connection()
+            if self.dimensions is None:
+                self.dimensions = vectors.shape[1]
+                conn.execute(
+                    "INSERT INTO settings VALUES ('dimensions', ?)", (self.dimensions,)
+                )
+            elif vectors.shape[1] != self.dimensions:
+                raise ValueError(
+                    f"Embeddings have {vectors.shape[1]} dimensions, the store "
+                    f"holds {self.dimensions}"
+                )
+
+            alive = self._snapshot[-1]
+            rows = len(alive)
+            replaced = self._live_rows(conn, ids)
+            self._append(vectors, rows)
+            self._set_deleted(conn, replaced)
+            conn.executemany(
+                f"INSERT INTO chunks (row, id, document, metadata, "
+                f"{', '.join(INDEXED_METADATA)}) "
+                f"VALUES (?, ?, ?, ?{', ?' * len(INDEXED_METADATA)})",
+                [
+                    (
+                        rows + i,
+                        doc_id,
+                        text,
+                        json.dumps(metadata) if metadata else None,
+                        *((metadata or {}).get(key) for key in INDEXED_METADATA),
+                    )
+                    for i, (doc_id, text, metadata) in enumerate(
+                        zip(ids, documents, metadatas)
+                    )
+                ],
+            )
+            conn.commit()
+
+            alive = np.concatenate([alive, np.ones(len(ids), dtype=bool)])
+            alive[replaced] = False
+            self._snapshot = (*self._map(len(alive)), alive)
+            self._version += 1
+
+    def delete(self, ids: List[str]):
+        with self._write_lock:
+            conn = self._connection()
+            rows = self._live_rows(conn, ids)
+            self._set_deleted(conn, rows)
+            conn.commit()
+            *matrices, alive = self._snapshot
+            alive = alive.copy()
+            alive[rows] = False
+            self._snapshot = (*matrices, alive)
+            self._version += 1
+
+    def filter_ids(
+        self, ids: Optional[List[str]] = None, where: Optional[dict] = None
+    ) -> List[str]:
+        conn = self._connection()
+        condition, params = where_sql(where) if where else ("1", [])
+        query = f"SELECT id FROM chunks WHERE deleted = 0 AND {condition}"
+        if ids is None:
+            return [row[0] for row in conn.execute(query, params)]
+        return [
+            row[0]
+            for row in chunked_in_query(
+                conn, query + " AND id IN ({placeholders})", ids, params=params
+            )
+        ]
+
+    def get(self, ids: List[str]) -> List[Document]:
+        return [
+            _document(doc_id, text, metadata)
+            for doc_id, text, metadata in chunked_in_query(
+                self._connection(),
+                "SELECT id, document, metadata FROM chunks "
+                "WHERE deleted = 0 AND id IN ({placeholders})",
+                ids,
+            )
+        ]
+
+    def search(
+        self, embeddings: List[List[float]], k: int, where: Optional[dict] = None
+    ) -> List[List[Match]]:
+        matrix, codes, scales, alive = self._snapshot
+        if (matrix is None and codes is None) or not embeddings:
+            return [[] for _ in embeddings]
+        queries = normalize(np.asarray(embeddings, dtype=np.float32))
+        if where is None:
+            candidates = np.flatnonzero(alive)
+            # the full matrix is cheaper to scan than a gathered copy of it
+            rows = None
+        else:
+            candidates = self._matching_rows(where)
+            # rows appended after the snapshot was taken are not searched yet
+            candidates = rows = candidates[candidates < len(alive)]
+
+        k = min(k, len(candidates))
+        if not k:
+            return [[] for _ in embeddings]
+        if codes is None:
+            scores = self._scan(matrix, rows, queries)
+        else:
+            scores = self._scan(codes, rows, queries)
+            scores *= scales[rows if rows is not None else slice(None), None]
+        if rows is None and len(candidates) < len(alive):
+            scores = scores[candidates]
+
+        shortlist = k if codes is None else min(len(candidates), self.rerank_candidates)
+        top = np.argpartition(-scores, max(k, shortlist) - 1, axis=0)
+        rankings = []
+        for column, indices in enumerate(top[: max(k, shortlist)].T):
+            shortlisted = candidates[indices]
+            if codes is None:
+                similarities = scores[indices, column]
+            else:
+                # exact scores of the shortlist, read from the float32 rows
+                shortlisted = np.sort(shortlisted)
+                similarities = self._read_rows(shortlisted) @ queries[column]
+            best = np.argsort(-similarities)[:k]
+            rankings.append(
+                [(int(shortlisted[i]), float(similarities[i])) for i in best]
+            )
+
+        documents = self._rows({row for ranking in rankings for row, _ in ranking})
+        return [
+            [
+                (documents[row], _relevance_score(similarity))
+                for row, similarity in ranking
+            ]
+            for ranking in rankings
+        ]
+
+    def close(self):
+        with self._write_lock:
+            self._close_connections()
+            self._snapshot = (None, None, None, self._snapshot[-1])
+
+    def _map(self, rows: int) -> tuple[Optional[np.ndarray], ...]:
+        """
+        Maps the float32 matrix, or when quantized only the codes and scales.
+        """
+        if not rows:
+            return None, None, None
+        if not self.quantization:
+            return (
+                _memmap(self._vectors_path, np.float32, (rows, self.dimensions)),
+                None,
+                None,
+            )
+        return (
+            None,
+            _memmap(self._codes_path, np.int8, (rows, self.dimensions)),
+            _memmap(self._scales_path, np.float32, (rows,)),
+        )
+
+    def _read_rows(self, rows: np.ndarray) -> np.ndarray:
+        """
+        Reads float32 rows from disk without mapping the file, so re-ranking
+        never makes the full matrix resident. `rows` must be sorted.
+        """
+        row_bytes = self.dimensions * 4
+        vectors = np.empty((len(rows), self.dimensions), dtype=np.float32)
+        with open(self._vectors_path, "rb", buffering=0) as file:
+            for i, row in enumerate(rows):
+                file.seek(int(row) * row_bytes)
+                file.readinto(memoryview(vectors[i]).cast("B"))
+        return vectors
+
+    def _append(self, vectors: np.ndarray, rows: int):
+        """
+        Appends normalised vectors, and their codes when quantized, after the
+        first `rows` rows of each file.
+        """
+        _append_rows(self._vectors_path, vectors, rows)
+        if self.quantization:
+            self._append_codes(vectors, rows)
+
+    def _append_codes(self, vectors: np.ndarray, rows: int):
+        codes, scales = quantize(vectors)
+        _append_rows(self._codes_path, codes, rows)
+        _append_rows(self._scales_path, scales, rows)
+
+    def _backfill_codes(self, rows: int):
+        coded = 0
+        if self._codes_path.exists() and self._scales_path.exists():
+            coded = min(
+                rows,
+                self._codes_path.stat().st_size // self.dimensions,
+                self._scales_path.stat().st_size // 4,
+            )
+        if coded == rows:
+            return
+        matrix = _memmap(self._vectors_path, np.float32, (rows, self.dimensions))
+        for start in range(coded, rows, self.max_batch_size):
+            self._append_codes(
+                np.asarray(matrix[start : start + self.max_batch_size]), start
+            )
+
+    def _scan(
+        self, matrix: np.ndarray, rows: Optional[np.ndarray], queries: np.ndarray
+    ) -> np.ndarray:
+        """
+        Multiplies the given rows (all if None) with the queries. int8 codes are
+        converted block by block into one reused buffer, which is faster than
+        a full-size float32 copy.
+        """
+        if matrix.dtype == np.float32 and rows is None:
+            return matrix @ queries.T
+        count = len(matrix) if rows is None else len(rows)
+        scores = np.empty((count, len(queries)), dtype=np.float32)
+        buffer = np.empty((min(count, self._SCAN_BLOCK), self.dimensions), np.float32)
+        for start in range(0, count, self._SCAN_BLOCK):
+            stop = start + self._SCAN_BLOCK
+            block = matrix[start:stop] if rows is None else matrix[rows[start:stop]]
+            converted = buffer[: len(block)]
+            np.copyto(converted, block, casting="unsafe")
+            np.matmul(converted, queries.T, out=scores[start:stop])
+        return scores
+
+    def _matching_rows(self, where: dict) -> np.ndarray:
+        key = (self._version, json.dumps(where, sort_keys=True))
+        rows = self._filter_cache.get(key)
+        if rows is None:
+            condition, params = where_sql(where)
+            result = self._connection().execute(
+                f"SELECT row FROM chunks WHERE deleted = 0 AND {condition}", params
+            )
+            rows = np.fromiter((row for (row,) in result), dtype=np.int64)
+            self._filter_cache.set(key, rows)
+        return rows
+
+    def _rows(self, rows: set[int]) -> dict[int, Document]:
+        # deleted rows are still readable, so results stay consistent with the
+        # snapshot the search ran on
+        return {
+            row: _document(doc_id, text, metadata)
+            for row, doc_id, text, metadata in chunked_in_query(
+                self._connection(),
+                "SELECT row, id, document, metadata FROM chunks "
+                "WHERE row IN ({placeholders})",
+                list(rows),
+            )
+        }
+
+    def _live_rows(self, conn: sqlite3.Connection, ids: List[str]) -> List[int]:
+        return [
+            row
+            for (row,) in chunked_in_query(
+                conn,
+                "SELECT row FROM chunks WHERE deleted = 0 AND id IN ({placeholders})",
+                ids,
+            )
+        ]
+
+    def _set_deleted(self, conn: sqlite3.Connection, rows: List[int]):
+        conn.executemany(
+            "UPDATE chunks SET deleted = 1 WHERE row = ?", [(row,) for row in rows]
+        )
+
+
+# metadata keys also stored in indexed columns of the flat store's side table,
+# so the filters on them the API offers are index lookups instead of scans
+INDEXED_METADATA = ("source", "creation_timestamp")
+
+# Chroma `where` operators and their SQL equivalents
+_SQL_OPERATORS = {
+    "$eq": "=",
+    "$ne": "!=",
+    "$gt": ">",
+    "$gte": ">=",
+    "$lt": "<",
+    "$lte": "<=",
+    "$in": "IN",
+    "$nin": "NOT IN",
+}
+
+
+class ShardedVectorStore(VectorStore):
+    """
+    Chunks spread over several stores of the same backend, each with its own
+    files, so index size and write contention per shard stay bounded.
+
+    A chunk is written to the shard chosen by hashing its ID, or its `source`
+    metadata with `shard_key="source"`. Writes are split per shard and run in
+    parallel; searches run on all shards concurrently and their results are
+    merged by score. Reads and deletes ask every shard, as an ID alone does
+    not tell which shard a chunk assigned by source is in, and chunks stay
+    reachable when the shard key changes.
+
+    Attributes:
+        directory (Path): Directory of this shard layout.
+        shards (List[VectorStore]): The stores holding the chunks.
+        shard_key (str): "id" or "source", what chunks are assigned by.
+    """
+
+    def __init__(
+        self, directory: str | Path, shards: List[VectorStore], shard_key: str = "id"
+    ):
+        if shard_key not in ("id", "source"):
+            raise ValueError(f"Unsupported shard key: '{shard_key}'")
+        self.directory = Path(directory)
+        self.shards = shards
+        self.shard_key = shard_key
+        self.name = shards[0].name
+        self.max_batch_size = min(shard.max_batch_size for shard in shards)
+        self._executor = ThreadPoolExecutor(thread_name_prefix="shard")
+
+    def shard_of(self, chunk_id: str, metadata: Optional[dict] = None) -> int:
+        """
+        Returns the index of the shard a chunk is written to. Chunks without a
+        source are assigned by ID.
+        """
+        key = chunk_id
+        if self.shard_key == "source" and metadata and "source" in metadata:
+            key = str(metadata["source"])
+        digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+        return int.from_bytes(digest) % len(self.shards)
+
+    def count(self) -> int:
+        return sum(self._map(lambda shard: shard.count(), self.shards))
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        batches = {}
+        for row in zip(ids, embeddings, documents, metadatas):
+            batches.setdefault(self.shard_of(row[0], row[3]), []).append(row)
+        self._map(
+            lambda index: self.shards[index].upsert(*map(list, zip(*batches[index]))),
+            list(batches),
+        )
+
+    def delete(self, ids: List[str]):
+        self._map(lambda shard: shard.delete(ids), self.shards)
+
+    def filter_ids(
+        self, ids: Optional[List[str]] = None, where: Optional[dict] = None
+    ) -> List[str]:
+        found = self._map(
+            lambda shard: shard.filter_ids(ids, where), self._shards_for(where)
+        )
+        return [chunk_id for shard_ids in found for chunk_id in shard_ids]
+
+    def get(self, ids: List[str]) -> List[Document]:
+        found = self._map(lambda shard: shard.get(ids), self.shards)
+        return [doc for docs in found for doc in docs]
+
+    def search(
+        self, embeddings: List[List[float]], k: int, where: Optional[dict] = None
+    ) -> List[List[Match]]:
+        results = self._map(
+            lambda shard: shard.search(embeddings, k, where), self._shards_for(where)
+        )
+        return [
+            heapq.nlargest(k, itertools.chain(*matches), key=lambda match: match[1])
+            for matches in zip(*results)
+        ]
+
+    def scan_bytes(self) -> int:
+        """
+        Returns the bytes of vector data the shards scan per query together.
+        """
+        return sum(shard.scan_bytes() for shard in self.shards)
+
+    def stored_bytes(self) -> int:
+        """
+        Returns the bytes of vector data the shards store together.
+        """
+        return sum(shard.stored_bytes() for shard in self.shards)
+
+    def close(self):
+        self._map(lambda shard: shard.close(), self.shards)
+        self._executor.shutdown()
+
+    def _shards_for(self, where: Optional[dict]) -> List[VectorStore]:
+        """
+        Returns the shards that can hold chunks matching `where`. When shards
+        are assigned by source, a source filter skips all other shards.
+        """
+        sources = _where_sources(where) if self.shard_key == "source" else None
+        if sources is None:
+            return self.shards
+        indexes = {self.shard_of("", {"source": source}) for source in sources}
+        # a filter matching no source still needs one shard to answer it
+        return [shard for i, shard in enumerate(self.shards) if i in indexes] or [
+            self.shards[0]
+        ]
+
+    def _map(self, fn, items: list) -> list:
+        """
+        Calls `fn` on every item concurrently and returns the results in order.
+        """
+        if len(items) == 1:
+            return [fn(items[0])]
+        futures = [self._executor.submit(fn, item) for item in items]
+        return [future.result() for future in futures]
+
+
+def where_sql(where: dict) -> tuple[str, list]:
+    """
+    Translates a Chroma `where` filter into a SQL condition on the JSON
+    `metadata` column, or on the indexed column of keys in `INDEXED_METADATA`.
+
+    Args:
+        where (dict): Filter using `$and`, `$or` and the operators of
+            `_SQL_OPERATORS`; a bare value means `$eq`.
+
+    Returns:
+        tuple[str, list]: The condition and its bound parameters.
+    """
+    clauses, params = [], []
+    for key, condition in where.items():
+        if key in ("$and", "$or"):
+            parts = [where_sql(clause) for clause in condition]
+            joiner = " AND " if key == "$and" else " OR "
+            clauses.append("(" + joiner.join(sql for sql, _ in parts) + ")")
+            params.extend(param for _, part in parts for param in part)
+            continue
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        if key in INDEXED_METADATA:
+            column, column_params = key, []
+        else:
+            column = "json_extract(metadata, ?)"
+            column_params = ['$."' + key.replace('"', '\\"') + '"']
+        for operator, value in condition.items():
+            if operator not in _SQL_OPERATORS:
+                raise ValueError(f"Unsupported where operator: '{operator}'")
+            if operator in ("$in", "$nin"):
+                placeholders = ",".join("?" * len(value))
+                clauses.append(f"{column} {_SQL_OPERATORS[operator]} ({placeholders})")
+                params.extend([*column_params, *value])
+            else:
+                clauses.append(f"{column} {_SQL_OPERATORS[operator]} ?")
+                params.extend([*column_params, value])
+    return " AND ".join(clauses) or "1", params
+
+
+def quantize(vectors: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Encodes each row as int8 codes times a per-row scale.
+
+    Args:
+        vectors (np.ndarray): float32 matrix, one vector per row.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The int8 codes and the float32 scales;
+            `codes * scales[:, None]` approximates `vectors`.
+    """
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1
+    codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """
+    Scales each row to unit length, so dot products are cosine similarities.
+    """
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def _relevance_score(similarity: float) -> float:
+    # Chroma reports squared L2 distances, which are 2 - 2 * cosine on unit
+    # vectors, and LangChain turns them into 1 - distance / sqrt(2)
+    return 1.0 - (2.0 - 2.0 * similarity) / math.sqrt(2)
+
+
+def _append_rows(path: Path, array: np.ndarray, rows: int):
+    # truncating first drops bytes a torn earlier append may have left behind
+    with open(path, "ab") as f:
+        f.truncate(rows * array[:1].nbytes)
+        f.write(array.tobytes())
+
+
+def _memmap(path: Path, dtype, shape: tuple) -> np.ndarray:
+    return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+
+def _document(doc_id: str, text: str, metadata: Optional[str]) -> Document:
+    return Document(
+        id=doc_id, page_content=text, metadata=json.loads(metadata) if metadata else {}
+    )
+
+
+def _where_sources(where: Optional[dict]) -> Optional[set]:
+    """
+    Returns the sources a `where` filter restricts chunks to, or None if it
+    matches chunks of any source.
+    """
+    if not where:
+        return None
+    if "$and" in where:
+        restricted = [_where_sources(clause) for clause in where["$and"]]
+        restricted = [sources for sources in restricted if sources is not None]
+        return set.intersection(*restricted) if restricted else None
+    condition = where.get("source")
+    if condition is None:
+        return None
+    if not isinstance(condition, dict):
+        return {condition}
+    if "$eq" in condition:
+        return {condition["$eq"]}
+    if "$in" in condition:
+        return set(condition["$in"])
+    return None
+
+
+def get_vector_store(persist_directory: Path, collection_name: str) -> VectorStore:
+    """
+    Opens the vector store backend configured by `VECTOR_STORE`, split over
+    `VECTOR_STORE_SHARDS` shards assigned by `SHARD_KEY` when more than one.
+
+    Args:
+        persist_directory (Path): Directory of the vector index.
+        collection_name (str): Name of the collection within the index.
+
+    Returns:
+        VectorStore: The opened backend.
+    """
+    backend = os.getenv("VECTOR_STORE") or "chroma"
+    if backend not in ("chroma", "flat"):
+        raise VectorStoreError(message=backend)
+    shards = int(os.getenv("VECTOR_STORE_SHARDS", 1))
+    if shards <= 1:
+        return _open_vector_store(backend, persist_directory, collection_name)
+    # every layout has its own directory holding its shards and side indexes,
+    # so changing the number of shards starts an empty collection; each shard
+    # has its own files, so writes to one never lock the others
+    directory = persist_directory / f"{collection_name}.{backend}.shards{shards}"
+    return ShardedVectorStore(
+        directory,
+        [
+            _open_vector_store(backend, directory / f"shard{i}", collection_name)
+            for i in range(shards)
+        ],
+        shard_key=os.getenv("SHARD_KEY") or "id",
+    )
+
+
+def _open_vector_store(
+    backend: str, persist_directory: Path, collection_name: str
+) -> VectorStore:
+    if backend == "chroma":
+        return ChromaVectorStore(persist_directory, collection_name)
+    return FlatVectorStore(
+        persist_directory / f"{collection_name}.flat",
+        quantization=os.getenv("FLAT_QUANTIZATION") or None,
+        rerank_candidates=int(os.getenv("FLAT_RERANK_CANDIDATES", 200)),
+    )
@@ -0,0 +1,126 @@
+"""
+Synthetic corpora and a deterministic stub embedding model for the benchmark.
+
+Everything is generated from a seed, so two runs with the same arguments ingest
+and query exactly the same data.
+"""
+import hashlib
+import random
+from pathlib import Path
+from typing import List
+
+import numpy as np
+import pandas as pd
+from langchain_core.embeddings import Embeddings
+from pypdf import PdfWriter
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "ze", "pa", "qu", "xi"]
+
+
+class StubEmbeddings(Embeddings):
+    """
+    Hashes words into a fixed-size bag-of-words vector. Fast and offline, so the
+    benchmark measures the pipeline rather than the model.
+    """
+
+    model_name = "benchmark-stub"
+
+    def __init__(self, dimensions: int = 384):
+        self.dimensions = dimensions
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for word in text.lower().split():
+            digest = hashlib.blake2b(word.encode(), digest_size=8).digest()
+            vector[int.from_bytes(digest, "little") % self.dimensions] += 1
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+
+class Corpus:
+    """
+    Generates sentences from a fixed vocabulary of made-up words and SKUs.
+
+    Attributes:
+        seed (int): Seed of the random generator.
+        vocabulary (List[str]): Words sentences are drawn from.
+    """
+
+    def __init__(self, seed: int = 0, vocabulary_size: int = 5000):
+        self.seed = seed
+        self._random = random.Random(seed)
+        words = set()
+        while len(words) < vocabulary_size:
+            words.add(
+                "".join(self._random.choices(SYLLABLES, k=self._random.randint(2, 4)))
+            )
+        self.vocabulary = sorted(words)
+
+    def sentence(self, words: int = 12) -> str:
+        text = " ".join(self._random.choices(self.vocabulary, k=words))
+        if self._random.random() < 0.1:
+            text += f" SKU-{self._random.randint(1000, 9999)}"
+        return text.capitalize() + "."
+
+    def paragraph(self, sentences: int = 8) -> str:
+        return " ".join(self.sentence() for _ in range(sentences))
+
+    def queries(self, count: int) -> List[str]:
+        return [
+            " ".join(
+                self._random.choices(self.vocabulary, k=self._random.randint(2, 6))
+            )
+            for _ in range(count)
+        ]
+
+    def write_csv(self, path: Path, rows: int) -> Path:
+        pd.DataFrame(
+            {
+                "id": range(rows),
+                "description": [self.sentence() for _ in range(rows)],
+                "category": self._random.choices(["a", "b", "c", "d"], k=rows),
+                "price": [round(self._random.uniform(1, 500), 2) for _ in range(rows)],
+            }
+        ).to_csv(path, index=False)
+        return path
+
+    def write_text(self, path: Path, paragraphs: int) -> Path:
+        path.write_text("\n\n".join(self.paragraph() for _ in range(paragraphs)))
+        return path
+
+    def write_pdf(self, path: Path, pages: int, lines_per_page: int = 40) -> Path:
+        writer = PdfWriter()
+        font = writer._add_object(
+            DictionaryObject(
+                {
+                    NameObject("/Type"): NameObject("/Font"),
+                    NameObject("/Subtype"): NameObject("/Type1"),
+                    NameObject("/BaseFont"): NameObject("/Helvetica"),
+                }
+            )
+        )
+        for _ in range(pages):
+            page = writer.add_blank_page(width=612, height=792)
+            lines = [self.sentence(words=8) for _ in range(lines_per_page)]
+            content = DecodedStreamObject()
+            content.set_data(
+                (
+                    "BT /F1 9 Tf 12 TL 36 756 Td "
+                    + " ".join(f"({line}) Tj T*" for line in lines)
+                    + " ET"
+                ).encode("latin-1")
+            )
+            page[NameObject("/Contents")] = writer._add_object(content)
+            page[NameObject("/Resources")] = DictionaryObject(
+                {NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})}
+            )
+        with open(path, "wb") as f:
+            writer.write(f)
+        return path
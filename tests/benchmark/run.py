@@ -0,0 +1,390 @@
+"""
+BENCHMARK
+
+Offline benchmark of the ingestion and retrieval paths. It ingests synthetic
+corpora into throwaway collections and measures chunking, embedding, upsert,
+retrieval at several collection sizes, and searches running while a file is
+being ingested. Results are written as JSON so runs can be compared across
+commits.
+
+Usage:
+    python -m tests.benchmark.run --sizes 1000 10000 --output bench.json
+
+By default a deterministic stub embedding model is used, so the numbers reflect
+the pipeline itself. Pass `--model configured` to use the model configured by
+`EMBEDDING_MODEL` instead, e.g. a small model cached in `local_model`.
+
+`--vector-stores chroma flat` runs every scenario once per vector store backend,
+on identical corpora, so the backends can be compared side by side. The
+quantization scenario always compares Chroma with exact and int8 flat search.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from time import perf_counter
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from src.data_ingestion import DataIngestionPipeline, shutdown_pdf_executor
+from src.utils import VectorDB, base_path
+from tests.benchmark.corpus import Corpus, StubEmbeddings
+
+FILE_TYPES = {".csv": "text/csv", ".txt": "text/plain", ".pdf": "application/pdf"}
+
+# numbers collections across benchmarks, so names never repeat within a run
+_COLLECTION_NUMBERS = itertools.count(1)
+
+
+def recall_at_k(
+    expected: List[List[float]], retrieved: List[List[float]], tolerance=1e-4
+) -> float:
+    """
+    Returns the mean recall@k of each query, given the relevance scores of the
+    expected and retrieved top-k. A retrieved chunk counts as a hit when it
+    scores at least as high as the k-th expected one, so chunks tied with it
+    are not counted as misses.
+    """
+    return float(
+        np.mean(
+            [
+                min(sum(score >= want[-1] - tolerance for score in got), len(want))
+                / len(want)
+                for want, got in zip(expected, retrieved)
+                if want
+            ]
+        )
+    )
+
+
+def latency_stats(latencies: List[float]) -> dict:
+    """
+    Summarises latencies in seconds as milliseconds.
+    """
+    values = np.asarray(latencies) * 1000
+    return {
+        "count": len(latencies),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "max_ms": float(values.max()),
+    }
+
+
+class Benchmark:
+    """
+    Runs the benchmark scenarios in a scratch directory.
+
+    Attributes:
+        workdir (Path): Scratch directory for corpora, collections and caches.
+        model (Optional[Embeddings]): Embedding model, None for the configured one.
+        vector_store (str): Vector store backend, as set by `VECTOR_STORE`.
+        corpus (Corpus): Generator of the synthetic data.
+    """
+
+    def __init__(self, workdir: Path, model, seed: int, vector_store: str = "chroma"):
+        self.workdir = workdir
+        self.model = model
+        self.vector_store = vector_store
+        self.corpus = Corpus(seed=seed)
+
+    def open_db(
+        self, vector_store: Optional[str] = None, quantization: str = ""
+    ) -> VectorDB:
+        """
+        Opens an empty collection with its own embedding cache, so every
+        scenario embeds its chunks from scratch.
+        """
+        vector_store = vector_store or self.vector_store
+        name = f"bench_{vector_store}_{next(_COLLECTION_NUMBERS)}"
+        os.environ["VECTOR_STORE"] = vector_store
+        os.environ["FLAT_QUANTIZATION"] = quantization
+        os.environ["COLLECTION_NAME"] = name
+        os.environ["EMBEDDING_CACHE_PATH"] = str(self.workdir / f"{name}.sqlite")
+        return VectorDB(embedding_model=self.model)
+
+    def ingest(self, db: VectorDB, path: Path, column_name: Optional[str] = None):
+        pipeline = DataIngestionPipeline(
+            file_path=str(path),
+            filename=path.name,
+            file_type=FILE_TYPES[path.suffix],
+            column_name=column_name,
+            db=db,
+        )
+        start = perf_counter()
+        pipeline.run()
+        return {
+            "seconds": perf_counter() - start,
+            "chunks": pipeline.chunk_counts["processed"],
+            **pipeline.throughput,
+            "stages": pipeline.timings,
+        }
+
+    def ingestion(self, csv_rows: int, text_paragraphs: int, pdf_pages: int) -> dict:
+        """
+        Ingests one file of each supported type into its own collection.
+        """
+        files = {
+            "csv": (
+                self.corpus.write_csv(self.workdir / "ingest.csv", csv_rows),
+                "description",
+            ),
+            "text": (
+                self.corpus.write_text(self.workdir / "ingest.txt", text_paragraphs),
+                None,
+            ),
+            "pdf": (
+                self.corpus.write_pdf(self.workdir / "ingest.pdf", pdf_pages),
+                None,
+            ),
+        }
+        results = {}
+        for kind, (path, column_name) in files.items():
+            db = self.open_db()
+            try:
+                results[kind] = self.ingest(db, path, column_name)
+            finally:
+                db.close()
+        return results
+
+    def retrieval(self, sizes: List[int], queries: int, batch_size: int) -> list:
+        """
+        Measures single and batched search latency at each collection size.
+        """
+        query_texts = self.corpus.queries(queries)
+        results = []
+        for size in sizes:
+            db = self.open_db()
+            try:
+                path = self.corpus.write_csv(self.workdir / f"size_{size}.csv", size)
+                result = {
+                    "size": size,
+                    "ingest": self.ingest(db, path, "description"),
+                }
+                for mode in ("vector", "hybrid"):
+                    result[mode] = self._time_each(
+                        query_texts, lambda q: db.retrieve_documents(q, mode=mode)
+                    )
+                batches = [
+                    query_texts[start : start + batch_size]
+                    for start in range(0, len(query_texts), batch_size)
+                ]
+                batch_latencies = self._time_each(
+                    batches,
+                    lambda batch: db.retrieve_documents_batch(
+                        [(q, None, None, "vector") for q in batch]
+                    ),
+                )
+                result["vector_batch"] = {
+                    "batch_size": batch_size,
+                    **batch_latencies,
+                }
+                results.append(result)
+            finally:
+                db.close()
+        return results
+
+    def mixed(self, size: int, ingest_rows: int, concurrency: int) -> dict:
+        """
+        Searches from `concurrency` threads while another file is ingested.
+        """
+        db = self.open_db()
+        try:
+            self.ingest(
+                db,
+                self.corpus.write_csv(self.workdir / "mixed_base.csv", size),
+                "description",
+            )
+            path = self.corpus.write_csv(self.workdir / "mixed.csv", ingest_rows)
+            query_texts = self.corpus.queries(1000)
+            done = threading.Event()
+            ingest_result = {}
+
+            def ingest():
+                try:
+                    ingest_result.update(self.ingest(db, path, "description"))
+                finally:
+                    done.set()
+
+            def search(worker: int) -> List[float]:
+                latencies = []
+                i = worker
+                while not done.is_set():
+                    start = perf_counter()
+                    db.retrieve_documents(query_texts[i % len(query_texts)])
+                    latencies.append(perf_counter() - start)
+                    i += concurrency
+                return latencies
+
+            with ThreadPoolExecutor(max_workers=concurrency + 1) as pool:
+                ingest_future = pool.submit(ingest)
+                searches = [pool.submit(search, i) for i in range(concurrency)]
+                ingest_future.result()
+                latencies = [value for f in searches for value in f.result()]
+            return {
+                "size": size,
+                "concurrency": concurrency,
+                "ingest": ingest_result,
+                "search": latency_stats(latencies) if latencies else None,
+            }
+        finally:
+            db.close()
+
+    def quantization(self, size: int, queries: int, k: int) -> dict:
+        """
+        Searches one corpus with Chroma, exact flat search and int8 flat search,
+        and reports recall@k against Chroma and against exact search, with the
+        vector bytes each flat search scans and each flat store keeps. Searches
+        go to the vector stores directly, as retrieved documents carry rounded
+        scores.
+        """
+        path = self.corpus.write_csv(self.workdir / f"quantization_{size}.csv", size)
+        query_texts = self.corpus.queries(queries)
+        backends = {
+            "chroma": ("chroma", ""),
+            "flat": ("flat", ""),
+            "flat_int8": ("flat", "int8"),
+        }
+        results, rankings = {}, {}
+        for backend, (vector_store, quantization) in backends.items():
+            db = self.open_db(vector_store, quantization)
+            try:
+                self.ingest(db, path, "description")
+                embeddings = db.embedding_model.embed_queries(query_texts)
+                retrieved = []
+                result = self._time_each(
+                    embeddings,
+                    lambda embedding: retrieved.append(
+                        [score for _, score in db.store.search([embedding], k)[0]]
+                    ),
+                )
+                rankings[backend] = retrieved
+                results[backend] = {"search": result}
+                if vector_store == "flat":
+                    results[backend]["scan_bytes"] = db.store.scan_bytes()
+                    results[backend]["stored_bytes"] = db.store.stored_bytes()
+            finally:
+                db.close()
+
+        for backend, result in results.items():
+            result["recall_vs_chroma"] = recall_at_k(
+                rankings["chroma"], rankings[backend]
+            )
+            result["recall_vs_exact"] = recall_at_k(rankings["flat"], rankings[backend])
+        return {
+            "size": size,
+            "k": k,
+            # int8 maps and scans a quarter of the bytes; codes and float32 rows
+            # are both kept on disk
+            "scan_ratio": results["flat_int8"]["scan_bytes"]
+            / results["flat"]["scan_bytes"],
+            "stored_ratio": results["flat_int8"]["stored_bytes"]
+            / results["flat"]["stored_bytes"],
+            **results,
+        }
+
+    @staticmethod
+    def _time_each(items: list, call: Callable) -> dict:
+        latencies = []
+        for item in items:
+            start = perf_counter()
+            call(item)
+            latencies.append(perf_counter() - start)
+        return latency_stats(latencies)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=base_path,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--csv-rows", type=int, default=5000)
+    parser.add_argument("--text-paragraphs", type=int, default=500)
+    parser.add_argument("--pdf-pages", type=int, default=100)
+    parser.add_argument("--mixed-rows", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--recall-k", type=int, default=10)
+    parser.add_argument("--model", choices=["stub", "configured"], default="stub")
+    parser.add_argument(
+        "--vector-stores", nargs="+", choices=["chroma", "flat"], default=["chroma"]
+    )
+    parser.add_argument("--shards", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, default=Path("benchmark.json"))
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> dict:
+    args = parse_args(argv)
+    workdir = Path(tempfile.mkdtemp(prefix="benchmark-"))
+    os.environ["VECTOR_INDEX_NAME"] = str(workdir / "index")
+    os.environ["VECTOR_STORE_SHARDS"] = str(args.shards)
+    # caches would hide the search cost after the first repetition of a query
+    os.environ["QUERY_EMBEDDING_CACHE_SIZE"] = "0"
+    os.environ["QUERY_RESULT_CACHE_SIZE"] = "0"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    model = StubEmbeddings() if args.model == "stub" else None
+    try:
+        report = {
+            "meta": {
+                "commit": git_commit(),
+                "datetime": datetime.now().isoformat(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "cpus": os.cpu_count(),
+                "args": {k: str(v) for k, v in vars(args).items()},
+            },
+            "vector_stores": {},
+        }
+        for vector_store in args.vector_stores:
+            # a fresh corpus per backend, so each one ingests the same data
+            benchmark = Benchmark(workdir, model, args.seed, vector_store)
+            report["vector_stores"][vector_store] = {
+                "ingestion": benchmark.ingestion(
+                    args.csv_rows, args.text_paragraphs, args.pdf_pages
+                ),
+                "retrieval": benchmark.retrieval(
+                    args.sizes, args.queries, args.batch_size
+                ),
+                "mixed": benchmark.mixed(
+                    args.sizes[0], args.mixed_rows, args.concurrency
+                ),
+            }
+        report["quantization"] = Benchmark(workdir, model, args.seed).quantization(
+            args.sizes[-1], args.queries, args.recall_k
+        )
+    finally:
+        shutdown_pdf_executor()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    args.output.write_text(json.dumps(report, indent=2))
+    print(f"Benchmark results written to {args.output}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
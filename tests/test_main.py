@@ -1,12 +1,43 @@
+import io
+import itertools
+import json
+import logging
+import logging.handlers
 import mimetypes
 import os
 import pathlib
+import queue
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
+import pandas as pd
 import pytest
 from fastapi.testclient import TestClient
+from langchain.schema import Document
+from langchain_core.embeddings import Embeddings
 
+from src.admission import AdmissionController
 from src.app import compose_app
+from src.data_ingestion import DataIngestionPipeline
+from src.embedding import CachedEmbeddings, EmbeddingScheduler, QueryBatcher
+from src.exception import AdmissionRejectedError
+from src.lexical import LexicalIndex
+from src.manifest import SourceManifest
 from src.model import RetrieveDocInput
+from src.utils import (
+    DeferredQueueHandler,
+    JsonFormatter,
+    SamplingFilter,
+    VectorDB,
+    clean_stale_workspaces,
+    content_hash,
+    get_vector_db,
+    shutdown_logger,
+)
+from src.vectorstore import FlatVectorStore, ShardedVectorStore
 
 app = compose_app()
 
@@ -16,6 +47,8 @@ base_dir = pathlib.Path("tests/mock_data")
 
 params = os.listdir(base_dir)
 
+ONNX_MODEL_PATH = pathlib.Path("local_model/e5-small-v2-onnx/model.onnx")
+
 
 @pytest.fixture(params=params)
 def file_upload_fixture(request):
@@ -23,21 +56,119 @@ def file_upload_fixture(request):
     return file_path
 
 
+class CountingEmbeddings(Embeddings):
+    """
+    Embeds a text as its length and records the texts of every model call.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_query(self, text):
+        return [float(len(text)), 1.0]
+
+
 def test_home_default():
     response = client.get("/")
     assert response.status_code == 200
     assert response.json() == {"message": "Welcome to data ingestion pipeline!"}
 
 
+def test_health_reports_vector_db(monkeypatch):
+    get_vector_db()
+    response = client.get("/health")
+    assert response.status_code == 200
+    assert response.json()["vector_db"]["ready"] is True
+    assert response.json()["vector_db"]["documents"] >= 0
+
+    monkeypatch.setattr("src.app.get_vector_db", lambda create=True: None)
+    response = client.get("/health")
+    assert response.status_code == 503
+    assert response.json()["vector_db"] == {"ready": False, "error": "not opened"}
+
+
+def test_process_time_header():
+    response = client.get("/")
+    assert response.headers["X-Process-Time"].endswith("s")
+
+
 def test_retrieve_document():
     query = "AI and its impact in IT"
     payload = RetrieveDocInput(query=query).model_dump()
     response = client.post("/retrieve/docs", json=payload)
-    print(response)
     assert response.status_code == 200
     assert response.json() is not None
 
 
+def test_retrieve_document_filtered():
+    payload = {
+        "query": "AI and its impact in IT",
+        "filters": {"source": ["test.txt"], "created_after": "2000-01-01T00:00:00"},
+    }
+    response = client.post("/retrieve/docs", json=payload)
+    assert response.status_code == 200
+    for doc in response.json()["documents"]:
+        assert doc["metadata"]["source"] == "test.txt"
+
+
+def test_retrieve_document_rejects_operator_keys():
+    payload = {"query": "AI", "filters": {"metadata": {"$or": "a"}}}
+    response = client.post("/retrieve/docs", json=payload)
+    assert response.status_code == 422
+
+
+def test_retrieve_document_hybrid():
+    payload = RetrieveDocInput(query="AI and its impact in IT", mode="hybrid")
+    response = client.post("/retrieve/docs", json=payload.model_dump())
+    assert response.status_code == 200
+    for doc in response.json()["documents"]:
+        assert 0 <= doc["score"] <= 1
+
+
+def test_retrieve_documents_batch():
+    payload = {
+        "queries": [
+            {"query": "AI and its impact in IT"},
+            {"query": "Spotify artists", "top_k": 1},
+        ]
+    }
+    response = client.post("/retrieve/docs/batch", json=payload)
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert len(results) == 2
+    assert len(results[1]["documents"]) <= 1
+
+
+def test_retrieve_documents_batch_limits():
+    oversized = {"queries": [{"query": "AI"}] * 65}
+    assert client.post("/retrieve/docs/batch", json=oversized).status_code == 422
+    deep = {"queries": [{"query": "AI", "top_k": 101}]}
+    assert client.post("/retrieve/docs/batch", json=deep).status_code == 422
+
+
+def test_retrieve_cache_stats():
+    query = "AI and its impact in IT"
+    payload = RetrieveDocInput(query=query).model_dump()
+    client.post("/retrieve/docs", json=payload)
+    client.post("/retrieve/docs", json=payload)
+    response = client.get("/retrieve/cache")
+    assert response.status_code == 200
+    assert response.json()["query_result"]["hits"] >= 1
+
+
+def test_metrics_endpoint():
+    client.post("/retrieve/docs", json=RetrieveDocInput(query="AI").model_dump())
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'retrieval_stage_seconds_count{stage="serialization"}' in response.text
+    assert "cache_hits_total" in response.text
+
+
 # Happy Path
 def test_upload_file_acceptance(file_upload_fixture):
     file_name = file_upload_fixture.name
@@ -56,3 +187,517 @@ def test_upload_file_acceptance(file_upload_fixture):
     json_data = response.json()
 
     assert json_data["message"] == "Data ingestion pipeline initiated successfully."
+
+    status_response = client.get(f"/ingest/{json_data['job_id']}")
+    assert status_response.status_code == 200
+    assert status_response.json()["filename"] == file_name
+
+
+def test_upload_unsupported_file_type():
+    files = {"file": ("archive.zip", b"PK", "application/zip")}
+    response = client.post("/ingest", files=files)
+    assert response.status_code == 400
+
+
+def test_csv_documents_match_row_wise_construction():
+    pipeline = DataIngestionPipeline(
+        file_path="", filename="data.csv", file_type="text/csv", db=get_vector_db()
+    )
+    mixed = pd.DataFrame(
+        {
+            "text": ["first", "second", "third"],
+            "count": [1, 2, 3],
+            "flag": [True, False, True],
+            "score": [0.5, np.nan, 1.5],
+            "label": ["x", None, "z"],
+        }
+    )
+    frames = [
+        (pd.read_csv(base_dir / "SpotifySongs.csv"), "ArtistName"),
+        (mixed, "text"),
+    ]
+    for data, column_name in frames:
+        documents = pipeline.pre_processing_csv("data.csv", data, column_name)
+        # the row-wise construction it replaced, which also kept missing values
+        expected = [
+            {
+                key: (type(value), value)
+                for key, value in row.items()
+                if key != column_name and not pd.isna(value)
+            }
+            for row in data.to_dict(orient="records")
+        ]
+        assert len(documents) == len(expected)
+        for doc, text, metadata in zip(documents, data[column_name], expected):
+            assert doc.page_content == text
+            assert doc.id == content_hash(text)
+            assert doc.metadata.pop("source") == "data.csv"
+            doc.metadata.pop("creationdate")
+            doc.metadata.pop("creation_timestamp")
+            assert {
+                key: (type(value), value) for key, value in doc.metadata.items()
+            } == metadata
+
+
+def test_parallel_pdf_chunks_match_pypdf_loader(monkeypatch):
+    from langchain_community.document_loaders import PyPDFLoader
+
+    from src.data_ingestion import extract_pdf_pages, split_documents
+
+    path = str(base_dir / "llm_assisted_validation.pdf")
+    expected_pages = PyPDFLoader(path).load()
+    pages = extract_pdf_pages(path, 0, len(expected_pages))
+    assert [(page.page_content, page.metadata) for page in pages] == [
+        (page.page_content, page.metadata) for page in expected_pages
+    ]
+
+    # one page per task, so the mock PDF is extracted and chunked on the pool
+    monkeypatch.setenv("PDF_PAGES_PER_TASK", "1")
+    pipeline = DataIngestionPipeline(
+        file_path=path,
+        filename="llm_assisted_validation.pdf",
+        file_type="application/pdf",
+        db=get_vector_db(),
+    )
+    chunks = list(pipeline.create_chunks(pipeline.read_file()))
+    expected = split_documents(
+        pipeline.pre_processing_text("llm_assisted_validation.pdf", expected_pages)
+    )
+    assert len(expected_pages) > pipeline.pdf_pages_per_task
+
+    def without_ingestion_time(chunk):
+        return {
+            key: value
+            for key, value in chunk.metadata.items()
+            if key not in ("creationdate", "creation_timestamp")
+        }
+
+    assert [
+        (chunk.id, chunk.page_content, without_ingestion_time(chunk))
+        for chunk in chunks
+    ] == [
+        (chunk.id, chunk.page_content, without_ingestion_time(chunk))
+        for chunk in expected
+    ]
+
+
+def test_admission_rejects_over_limit():
+    controller = AdmissionController("test", max_concurrency=1, retry_after=3)
+    with controller.admit():
+        with pytest.raises(AdmissionRejectedError) as rejected:
+            with controller.admit():
+                pass
+    assert rejected.value.status_code == 429
+    assert rejected.value.retry_after == 3
+    assert controller.in_flight == 0
+
+
+def test_flat_vector_store_search(tmp_path):
+    store = FlatVectorStore(tmp_path / "flat")
+    store.upsert(
+        ids=["a", "b", "c"],
+        embeddings=[[1.0, 0.0], [0.6, 0.8], [0.0, 1.0]],
+        documents=["first", "second", "third"],
+        metadatas=[{"source": "x.txt"}, {"source": "y.txt"}, None],
+    )
+    matches = store.search([[1.0, 0.1]], k=2)[0]
+    assert [doc.id for doc, _ in matches] == ["a", "b"]
+    assert matches[0][1] > matches[1][1]
+
+    filtered = store.search([[1.0, 0.0]], k=3, where={"source": {"$in": ["y.txt"]}})
+    assert [doc.id for doc, _ in filtered[0]] == ["b"]
+
+    store.delete(["a"])
+    store.close()
+    store = FlatVectorStore(tmp_path / "flat")
+    assert store.count() == 2
+    assert store.search([[1.0, 0.0]], k=1)[0][0][0].id == "b"
+    store.close()
+
+
+def test_flat_vector_store_int8_matches_exact(tmp_path):
+    vectors = np.random.default_rng(0).normal(size=(500, 16))
+    ids = [str(i) for i in range(500)]
+    exact = FlatVectorStore(tmp_path / "flat")
+    exact.upsert(ids, vectors.tolist(), ids, [None] * len(ids))
+    exact.close()
+    # codes are computed for the rows written without quantization
+    quantized = FlatVectorStore(tmp_path / "flat", quantization="int8")
+    exact = FlatVectorStore(tmp_path / "flat")
+    assert quantized.scan_bytes() < exact.scan_bytes() / 3
+    # the float32 rows used for re-ranking stay on disk, beside the codes
+    assert quantized.stored_bytes() > exact.stored_bytes()
+    assert quantized._snapshot[0] is None
+
+    queries = vectors[:5].tolist()
+    for expected, matches in zip(
+        exact.search(queries, k=10), quantized.search(queries, k=10)
+    ):
+        assert [doc.id for doc, _ in matches] == [doc.id for doc, _ in expected]
+        assert [score for _, score in matches] == pytest.approx(
+            [score for _, score in expected]
+        )
+
+
+def test_lexical_index_prunes_common_terms(tmp_path):
+    index = LexicalIndex(tmp_path / "lexical.sqlite")
+    index.add(
+        Document(id=str(i), page_content=f"the product manual, page {i}")
+        for i in range(100)
+    )
+    index.add([Document(id="sku", page_content="the product manual for SKU-42")])
+
+    # "manual" is in every document, so only the identifier is scored
+    assert [doc_id for doc_id, _ in index.search("the manual SKU-42", k=5)] == ["sku"]
+    # a query made only of common terms still ranks on its rarest term
+    assert len(index.search("product manual", k=5)) == 5
+    assert index.search("the", k=5) == []
+
+    index.remove(["sku"])
+    assert index.search("SKU-42", k=5) == []
+    index.close()
+
+
+def test_sharded_vector_store_matches_single(tmp_path):
+    vectors = np.random.default_rng(0).normal(size=(300, 16)).tolist()
+    ids = [str(i) for i in range(300)]
+    metadatas = [{"source": f"{i % 6}.txt"} for i in range(300)]
+    single = FlatVectorStore(tmp_path / "single")
+    sharded = ShardedVectorStore(
+        tmp_path / "sharded",
+        [FlatVectorStore(tmp_path / "sharded" / f"shard{i}") for i in range(3)],
+        shard_key="source",
+    )
+    for store in (single, sharded):
+        store.upsert(ids, vectors, ids, metadatas)
+    assert sharded.count() == 300
+    assert all(0 < shard.count() < 300 for shard in sharded.shards)
+
+    where = {"source": {"$in": ["1.txt"]}}
+    assert len(sharded._shards_for(where)) == 1
+    for k, filters in ((10, None), (5, where)):
+        for expected, matches in zip(
+            single.search(vectors[:5], k, filters),
+            sharded.search(vectors[:5], k, filters),
+        ):
+            assert [doc.id for doc, _ in matches] == [doc.id for doc, _ in expected]
+
+    sharded.delete(ids[:50])
+    assert sharded.count() == 250
+    assert sorted(sharded.filter_ids(ids[:60])) == sorted(ids[50:60])
+    sharded.close()
+
+
+@pytest.mark.skipif(
+    not ONNX_MODEL_PATH.exists(), reason="ONNX export of e5-small-v2 not found"
+)
+def test_onnx_embeddings_match_huggingface():
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    from src.onnx_embedding import OnnxEmbeddings
+
+    texts = ["AI and its impact in IT", "Spotify artists", "A longer text. " * 40]
+    onnx = OnnxEmbeddings(ONNX_MODEL_PATH, model_name="e5-small-v2:onnx")
+    reference = HuggingFaceEmbeddings(
+        model_name="intfloat/e5-small-v2",
+        cache_folder=str(pathlib.Path("local_model/e5-small-v2")),
+    )
+    similarity = np.sum(
+        np.array(onnx.embed_documents(texts))
+        * np.array(reference.embed_documents(texts)),
+        axis=1,
+    )
+    assert similarity.min() > 0.999
+
+
+def test_query_batcher_groups_concurrent_queries():
+    class RecordingEmbeddings(Embeddings):
+        def embed_documents(self, texts):
+            calls.append(texts)
+            if "fail" in texts:
+                raise RuntimeError("model failed")
+            return [[float(len(text))] for text in texts]
+
+        def embed_query(self, text):
+            raise AssertionError("queries must be embedded in batches")
+
+    calls = []
+    batcher = QueryBatcher(RecordingEmbeddings(), window_ms=500, max_batch_size=8)
+    texts = ["q" * length for length in range(1, 13)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        vectors = list(pool.map(batcher.embed_query, texts[:8]))
+    assert vectors == [[float(len(text))] for text in texts[:8]]
+    assert len(calls) == 1 and sorted(calls[0]) == texts[:8]
+
+    calls.clear()
+    with ThreadPoolExecutor(max_workers=12) as pool:
+        vectors = list(pool.map(batcher.embed_query, texts))
+    assert vectors == [[float(len(text))] for text in texts]
+    assert len(calls) >= 2 and max(len(call) for call in calls) <= 8
+
+    with pytest.raises(RuntimeError, match="model failed"):
+        batcher.embed_query("fail")
+    batcher.close()
+
+
+def test_embedding_scheduler_batches_by_length():
+    class LengthEmbeddings(Embeddings):
+        def embed_documents(self, texts):
+            calls.append(texts)
+            return [[float(len(text))] for text in texts]
+
+        def embed_query(self, text):
+            return [float(len(text))]
+
+    calls = []
+    texts = ["short"] * 50 + ["long " * 400] * 5 + ["short"] * 50
+    scheduler = EmbeddingScheduler(
+        LengthEmbeddings(), token_budget=1024, max_batch_size=64
+    )
+    assert scheduler.embed_documents(texts) == [[float(len(text))] for text in texts]
+    for batch in calls:
+        assert len({len(text) for text in batch}) == 1
+        assert len(batch) * scheduler.estimate_tokens(batch[-1]) <= 1024
+
+
+def test_cached_embeddings_persist_across_instances(tmp_path):
+    texts = ["first text", "second text", "first text"]
+    model = CountingEmbeddings()
+    cache = CachedEmbeddings(model, "counting", path=tmp_path / "cache.sqlite")
+    expected = cache.embed_documents(texts)
+    assert model.calls == [["first text", "second text"]]
+    assert (cache.hits, cache.misses) == (1, 2)
+    cache.close()
+
+    model = CountingEmbeddings()
+    cache = CachedEmbeddings(model, "counting", path=tmp_path / "cache.sqlite")
+    assert cache.embed_documents(texts) == expected
+    assert model.calls == []
+    assert (cache.hits, cache.misses) == (3, 0)
+    assert cache.stats()["size"] == 2
+    cache.close()
+
+    # vectors are keyed by model, so another model computes its own
+    model = CountingEmbeddings()
+    cache = CachedEmbeddings(model, "other", path=tmp_path / "cache.sqlite")
+    cache.embed_documents(texts)
+    assert model.calls == [["first text", "second text"]]
+    cache.close()
+
+
+def test_cached_embeddings_evict_least_recently_used(tmp_path, monkeypatch):
+    clock = itertools.count()
+    monkeypatch.setattr("src.embedding.time", lambda: float(next(clock)))
+    model = CountingEmbeddings()
+    cache = CachedEmbeddings(
+        model, "counting", path=tmp_path / "cache.sqlite", max_entries=3
+    )
+    cache.embed_documents(["a", "b", "c"])
+    # a is read again, so b and c are now the least recently used
+    cache.embed_documents(["a"])
+    cache.embed_documents(["d", "e"])
+    assert cache.stats()["size"] == 3
+    assert cache.evictions == 2
+    assert cache._count == cache._row_count()
+
+    model.calls.clear()
+    cache.embed_documents(["a", "d", "e"])
+    assert model.calls == []
+    cache.embed_documents(["b"])
+    assert model.calls == [["b"]]
+    assert cache._count == cache._row_count() == 3
+    cache.close()
+
+
+def test_json_formatter_writes_one_object_per_record():
+    formatter = JsonFormatter()
+    logger = logging.getLogger("test.json")
+    try:
+        raise ValueError("broken")
+    except ValueError:
+        records = [
+            logger.makeRecord(
+                "test.json", logging.INFO, __file__, 1, {"action": 'say "hi"'}, (), None
+            ),
+            logger.makeRecord(
+                "test.json", logging.ERROR, __file__, 1, "%s rows", (3,), None
+            ),
+            logger.makeRecord(
+                "test.json", logging.ERROR, __file__, 1, "failed", (), sys.exc_info()
+            ),
+        ]
+    entries = [json.loads(formatter.format(record)) for record in records]
+    assert entries[0]["action"] == 'say "hi"'
+    assert entries[0]["level"] == "INFO"
+    assert entries[0]["logger"] == "test.json"
+    assert entries[1]["message"] == "3 rows"
+    assert "ValueError: broken" in entries[2]["exception"]
+
+
+def test_sampling_filter_keeps_warnings():
+    random.seed(0)
+    sampler = SamplingFilter(0.25)
+    logger = logging.getLogger("test.sampling")
+
+    def kept(level: int, count: int = 10000) -> int:
+        record = logger.makeRecord("test.sampling", level, __file__, 1, "", (), None)
+        return sum(sampler.filter(record) for _ in range(count))
+
+    for level in (logging.DEBUG, logging.INFO):
+        assert 0.23 < kept(level) / 10000 < 0.27
+    sampler.rate = 0
+    assert kept(logging.INFO) == 0
+    assert kept(logging.WARNING, 100) == kept(logging.ERROR, 100) == 100
+
+
+def test_log_queue_is_flushed_on_shutdown(monkeypatch):
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JsonFormatter())
+    log_queue = queue.Queue(10000)
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    monkeypatch.setattr("src.utils._LOG_LISTENER", listener)
+    logger = logging.getLogger("test.queue")
+    monkeypatch.setattr(logger, "propagate", False)
+    monkeypatch.setattr(logger, "handlers", [DeferredQueueHandler(log_queue)])
+
+    for number in range(1000):
+        logger.warning({"application": "test", "action": number})
+    shutdown_logger()
+    lines = stream.getvalue().splitlines()
+    assert [json.loads(line)["action"] for line in lines] == list(range(1000))
+
+    # records are dropped rather than blocking once the queue is full
+    dropped = DeferredQueueHandler.dropped
+    monkeypatch.setattr(logger, "handlers", [DeferredQueueHandler(queue.Queue(1))])
+    for number in range(3):
+        logger.warning({"application": "test", "action": number})
+    assert DeferredQueueHandler.dropped == dropped + 2
+
+
+def test_ingestion_job_not_found():
+    response = client.get("/ingest/unknown-job")
+    assert response.status_code == 404
+
+
+def wait_for_job(job_id: str) -> dict:
+    for _ in range(600):
+        job = client.get(f"/ingest/{job_id}").json()
+        if job["status"] in ("completed", "failed"):
+            return job
+        time.sleep(0.1)
+    raise TimeoutError(job_id)
+
+
+def test_reingest_replaces_stale_chunks():
+    paragraphs = [f"Section {i} of the revised handbook." * 10 for i in range(5)]
+    versions = [paragraphs, paragraphs[:2] + ["A rewritten section."] + paragraphs[3:]]
+    jobs = []
+    for version in versions:
+        files = {"file": ("handbook.txt", "\n\n".join(version), "text/plain")}
+        response = client.post("/ingest", files=files, data={"column_name": None})
+        jobs.append(wait_for_job(response.json()["job_id"]))
+
+    assert jobs[1]["status"] == "completed"
+    assert jobs[1]["chunks"]["added"] >= 1
+    assert jobs[1]["chunks"]["removed"] >= 1
+    assert jobs[1]["chunks"]["added"] < jobs[1]["chunks"]["processed"]
+
+
+def test_source_manifest_stages_versions(tmp_path):
+    manifest = SourceManifest(tmp_path / "manifest.sqlite")
+    for source, chunk_ids in (("a.txt", ["1", "2", "3"]), ("b.txt", ["3"])):
+        run = manifest.begin()
+        assert manifest.stage(run, source, chunk_ids) == set()
+        manifest.replace(run, source)
+    assert list(manifest.orphaned()) == []
+
+    # the new version arrives in two batches; "3" is still used by b.txt
+    run = manifest.begin()
+    assert manifest.stage(run, "a.txt", ["1", "4"]) == {"1"}
+    assert manifest.stage(run, "a.txt", ["5"]) == set()
+    manifest.replace(run, "a.txt")
+    assert [sorted(batch) for batch in manifest.orphaned()] == [["2"]]
+    assert list(manifest.orphaned()) == []
+
+    run = manifest.begin()
+    assert manifest.stage(run, "a.txt", ["1", "4", "5"]) == {"1", "4", "5"}
+    manifest.close()
+
+
+def test_ingest_skips_duplicate_and_indexed_chunks(tmp_path, monkeypatch):
+    monkeypatch.setenv("VECTOR_INDEX_NAME", str(tmp_path / "db"))
+    monkeypatch.setenv("VECTOR_STORE", "flat")
+    monkeypatch.setenv("VECTOR_STORE_SHARDS", "1")
+    monkeypatch.setenv("EMBEDDING_CACHE_PATH", str(tmp_path / "cache.sqlite"))
+    # duplicates fall within one batch and across batches
+    monkeypatch.setenv("INGEST_BATCH_SIZE", "4")
+    artists = ["Queen", "Abba", "Queen", "Blur", "Abba", "Oasis", "Queen", "Blur"]
+    file_path = tmp_path / "artists.csv"
+    pd.DataFrame({"ArtistName": artists, "Plays": range(len(artists))}).to_csv(
+        file_path, index=False
+    )
+    model = CountingEmbeddings()
+    db = VectorDB(embedding_model=model)
+
+    for _ in range(2):
+        pipeline = DataIngestionPipeline(
+            file_path=str(file_path),
+            filename="artists.csv",
+            file_type="text/csv",
+            column_name="ArtistName",
+            db=db,
+        )
+        pipeline.run()
+        assert db.store.count() == 4
+        assert sorted(text for call in model.calls for text in call) == sorted(
+            set(artists)
+        )
+    assert pipeline.chunk_counts == {"processed": 8, "added": 0, "removed": 0}
+    db.close()
+
+
+def test_switching_vector_store_layout_reingests(tmp_path, monkeypatch):
+    monkeypatch.setenv("VECTOR_INDEX_NAME", str(tmp_path))
+    added = []
+    for vector_store, shards in (("chroma", "1"), ("flat", "1"), ("flat", "3")):
+        monkeypatch.setenv("VECTOR_STORE", vector_store)
+        monkeypatch.setenv("VECTOR_STORE_SHARDS", shards)
+        db = VectorDB()
+        pipeline = DataIngestionPipeline(
+            file_path=str(base_dir / "test.txt"),
+            filename="test.txt",
+            file_type="text/plain",
+            db=db,
+        )
+        pipeline.run()
+        added.append(pipeline.chunk_counts["added"])
+        assert db.store.count() == pipeline.chunk_counts["processed"]
+        db.close()
+    assert added[0] == added[1] == added[2] > 0
+
+
+def test_startup_keeps_workspaces_of_running_processes(tmp_path, monkeypatch):
+    monkeypatch.setattr("src.utils.workspace_root", lambda: tmp_path / str(os.getpid()))
+    own = tmp_path / str(os.getpid()) / "queued-job"
+    # the parent process is running; PIDs never reach 999999999
+    running = tmp_path / str(os.getppid()) / "queued-job"
+    exited = tmp_path / "999999999" / "queued-job"
+    for workspace in (own, running, exited):
+        workspace.mkdir(parents=True)
+
+    clean_stale_workspaces()
+    assert own.exists() and running.exists()
+    assert not exited.parent.exists()
+
+
+def test_ready_after_warmup():
+    with TestClient(app) as lifespan_client:
+        for _ in range(600):
+            response = lifespan_client.get("/ready")
+            if response.status_code == 200:
+                break
+            time.sleep(0.1)
+        assert response.status_code == 200
+        assert response.json()["startup_seconds"]["total"] > 0